@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import abc
 import subprocess
 import yt_dlp
 import shutil
@@ -9,8 +10,396 @@ import tempfile
 from urllib.parse import urlparse
 import urllib.parse
 import urllib.request
+import urllib.error
+import http.client
 import argparse
-from typing import Optional, List
+import asyncio
+import ssl
+import json
+import threading
+import hashlib
+import time
+import itertools
+import contextvars
+import base64
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager, ExitStack, nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fractions import Fraction
+from typing import Optional, List, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in traces
+    resource = None
+
+WEBP_COMPRESSION_LEVEL = 3  # libwebp effort 0-6 (higher: smaller and slower)
+YDL_FORMAT = 'bestvideo[height<=1080][ext=mp4]/best[height<=1080][ext=mp4]'
+CACHE_DIR = os.environ.get("GIFPY_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gifcache")
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled or has run past its deadline."""
+
+class Job:
+    """
+    One scheduled conversion. Holds the result future, the deadline and the child
+    processes started on its behalf, so cancel() can kill them mid-encode.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.id = next(Job._ids)
+        self.future: Future = Future()
+        self.trace: Optional[Trace] = None
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def attach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.add(proc)
+        if self.cancelled:
+            proc.kill()
+
+    def detach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def cancel(self, reason: str = "cancelled"):
+        """Stop the job: fail its future and kill every child process it owns."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            procs = list(self._procs)
+        for proc in procs:
+            proc.kill()
+        self.finish(exc=JobCancelled(f"Job {self.id} {reason}"))
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled or its deadline has passed."""
+        if not self.cancelled and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("deadline exceeded")
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} {self.reason}")
+
+    def finish(self, result=None, exc: Optional[BaseException] = None):
+        """Complete the future once; later calls (e.g. after a cancel) are ignored."""
+        with self._lock:
+            if self.future.done():
+                return
+            if exc is not None:
+                self.future.set_exception(exc)
+            else:
+                self.future.set_result(result)
+
+    def result(self, timeout: Optional[float] = None):
+        return self.future.result(timeout)
+
+# The job the current thread works for; child processes are registered with it
+_CURRENT_JOB: contextvars.ContextVar = contextvars.ContextVar("gifpy_job", default=None)
+
+def _run(cmd: List[str], check: bool = False, stdin=None) -> subprocess.CompletedProcess:
+    """
+    subprocess.run with stdout and stderr captured. The process is registered
+    with the current job, so cancelling the job kills it.
+    """
+    job = _CURRENT_JOB.get()
+    if job is not None:
+        job.check()
+    proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if job is not None:
+        job.attach(proc)
+    try:
+        stdout, stderr, usage = _communicate(proc)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        if job is not None:
+            job.detach(proc)
+    _charge_child(usage)
+    if job is not None:
+        job.check()
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def _job_submit(pool: ThreadPoolExecutor, fn, *args) -> Future:
+    """pool.submit that carries the current job into the worker thread."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+class Trace:
+    """
+    Per-stage timings for one conversion: wall time plus the CPU time and peak RSS
+    (KiB) of the child processes each stage ran. summary() is JSON-ready.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.seconds: Optional[float] = None
+        self.spans: List[dict] = []
+        self.output_bytes: Optional[int] = None
+        self.frames: Optional[int] = None
+        self.preset: Optional[dict] = None
+        self.output_format: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+
+    def finish(self, result):
+        """Record the output (bytes, or a file path) and the total wall time."""
+        self.seconds = round(time.monotonic() - self.started, 3)
+        try:
+            if isinstance(result, (bytes, bytearray)):
+                data = result
+            else:
+                with open(result, "rb") as f:
+                    data = f.read()
+            self.output_bytes = len(data)
+            self.frames = gif_frame_count(data) if data[:3] == b"GIF" else webp_frame_count(data)
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def summary(self) -> dict:
+        with self._lock:
+            spans = [dict(s) for s in self.spans]
+        return {
+            "seconds": self.seconds if self.seconds is not None else round(time.monotonic() - self.started, 3),
+            "cpu_seconds": round(sum(s.get("cpu_seconds", 0.0) for s in spans), 3),
+            "peak_rss_kb": max((s.get("peak_rss_kb", 0) for s in spans), default=0),
+            "self_peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            "output_bytes": self.output_bytes,
+            "frames": self.frames,
+            "format": self.output_format,
+            "preset": self.preset,
+            "spans": spans,
+        }
+
+    def stage_totals(self) -> dict:
+        """{stage: {"count", "seconds", "cpu_seconds"}} summed over the spans."""
+        totals = {}
+        with self._lock:
+            for s in self.spans:
+                t = totals.setdefault(s["stage"], {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0})
+                t["count"] += 1
+                t["seconds"] = round(t["seconds"] + s.get("seconds", 0.0), 3)
+                t["cpu_seconds"] = round(t["cpu_seconds"] + s.get("cpu_seconds", 0.0), 3)
+        return totals
+
+_CURRENT_TRACE: contextvars.ContextVar = contextvars.ContextVar("gifpy_trace", default=None)
+_CURRENT_SPAN: contextvars.ContextVar = contextvars.ContextVar("gifpy_span", default=None)
+_SPAN_LOCK = threading.Lock()
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Time a pipeline stage into the current Trace. Yields the span record, so
+    the stage can add fields (e.g. bytes) before it closes. Child processes run
+    through _run inside it are charged to it.
+    """
+    record = dict(stage=stage, **fields)
+    token = _CURRENT_SPAN.set(record)
+    started = time.monotonic()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.monotonic() - started, 3)
+        _CURRENT_SPAN.reset(token)
+        trace = _CURRENT_TRACE.get()
+        if trace is not None:
+            trace.add(record)
+
+def _charge_child(usage):
+    """Add a reaped child's CPU time and peak RSS to the current span."""
+    record = _CURRENT_SPAN.get()
+    if record is None or usage is None:
+        return
+    with _SPAN_LOCK:
+        record["cpu_seconds"] = round(record.get("cpu_seconds", 0.0) + usage.ru_utime + usage.ru_stime, 3)
+        record["peak_rss_kb"] = max(record.get("peak_rss_kb", 0), usage.ru_maxrss)
+
+def _communicate(proc: subprocess.Popen):
+    """
+    proc.communicate() for a process with piped stdout and stderr, but reaped
+    with os.wait4 so its resource usage can be charged to the current span.
+    Returns (stdout, stderr, rusage or None).
+    """
+    if not hasattr(os, "wait4"):
+        stdout, stderr = proc.communicate()
+        return stdout, stderr, None
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    stdout = proc.stdout.read()
+    reader.join()
+    proc.stdout.close()
+    proc.stderr.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return stdout, errors[0] if errors else b"", usage
+
+def webp_frame_count(data: bytes) -> int:
+    """Number of frames in a WebP file: its ANMF chunks, or 1 for a still image."""
+    return sum(1 for fourcc, _ in _webp_chunks(data) if fourcc == b"ANMF") or 1
+
+class YdlPool:
+    """
+    Keeps warm yt_dlp.YoutubeDL instances so a long-lived process pays the
+    extractor setup once. Each caller gets an instance to itself; the output
+    template and format selector are swapped in for the duration of the checkout.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._idle: List[yt_dlp.YoutubeDL] = []
+        self._lock = threading.Lock()
+
+    def _create(self) -> yt_dlp.YoutubeDL:
+        return yt_dlp.YoutubeDL({
+            'quiet': True,
+            'noprogress': True,
+            'outtmpl': '%(id)s.%(ext)s',
+            'merge_output_format': 'mp4',
+            'format': YDL_FORMAT,
+        })
+
+    def warm(self):
+        """Create an instance up front and load the Twitter extractor into it."""
+        with self.acquire() as ydl:
+            ydl.get_info_extractor('Twitter')
+
+    @contextmanager
+    def acquire(self, outtmpl: Optional[str] = None, format_spec: Optional[str] = None):
+        with self._lock:
+            ydl = self._idle.pop() if self._idle else None
+        if ydl is None:
+            ydl = self._create()
+        default_tmpl = ydl.params['outtmpl']['default']
+        if outtmpl:
+            ydl.params['outtmpl']['default'] = outtmpl
+        if format_spec:
+            ydl.format_selector = ydl.build_format_selector(format_spec)
+        try:
+            yield ydl
+        finally:
+            ydl.params['outtmpl']['default'] = default_tmpl
+            if format_spec:
+                ydl.format_selector = ydl.build_format_selector(ydl.params['format'])
+            with self._lock:
+                keep = len(self._idle) < self.size
+                if keep:
+                    self._idle.append(ydl)
+            if not keep:
+                ydl.close()
+
+_YDL_POOL = YdlPool()
+
+class PostInfo:
+    """
+    yt-dlp metadata for one post, fetched once and handed to every stage of a
+    conversion (image detection, video download, image download).
+    PostInfo.extract_count counts the extract_info calls made through fetch().
+    """
+    extract_count = 0
+    _count_lock = threading.Lock()
+
+    def __init__(self, url: str, info: Optional[dict]):
+        self.url = url
+        self.info = info
+        self.post_id = extract_post_id(url)
+
+    @classmethod
+    def fetch(cls, url: str) -> "PostInfo":
+        with cls._count_lock:
+            cls.extract_count += 1
+        with span("extract_info"), _YDL_POOL.acquire() as ydl:
+            info = ydl.extract_info(url, download=False)
+        return cls(url, info)
+
+    @property
+    def entries(self) -> List[dict]:
+        if not isinstance(self.info, dict):
+            return []
+        if 'entries' in self.info:
+            return [e for e in (self.info['entries'] or []) if isinstance(e, dict)]
+        return [self.info]
+
+class PostInfoCache:
+    """
+    In-memory PostInfo per post id, so jobs for several clips or trims of one
+    post share a single metadata fetch. The post URL is fetched without its
+    /video/N suffix so every entry is available to _pick_entry.
+    """
+
+    def __init__(self):
+        self._posts = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> PostInfo:
+        post_id = extract_post_id(url)
+        with self._lock:
+            lock = self._locks.setdefault(post_id, threading.Lock())
+        with lock:
+            post = self._posts.get(post_id)
+            if post is None:
+                post = PostInfo.fetch(re.sub(r"/(?:video|photo)/\d+/?$", "", url.split("?")[0]))
+                self._posts[post_id] = post
+        return post
+
+MAX_SOURCE_HEIGHT = 1080
+
+def select_format(entry: Optional[dict], max_size: int, crop_angle: Optional[str] = None) -> Optional[dict]:
+    """
+    Smallest MP4 rendition whose long side (short side when cropping) reaches
+    max_size, progressive HTTP before HLS; else the largest up to 1080p.
+    """
+    if not isinstance(entry, dict):
+        return None
+    candidates = []
+    for f in entry.get('formats') or []:
+        w, h = f.get('width'), f.get('height')
+        if not w or not h or f.get('vcodec') == 'none' or f.get('ext') != 'mp4':
+            continue
+        if h > MAX_SOURCE_HEIGHT:
+            continue
+        candidates.append(f)
+    if not candidates:
+        return None
+
+    def covers(f) -> bool:
+        side = min(f['width'], f['height']) if crop_angle else max(f['width'], f['height'])
+        return side >= max_size
+
+    def rank(f):
+        return (f['width'] * f['height'], f.get('protocol') != 'https', f.get('tbr') or 0)
+
+    covering = [f for f in candidates if covers(f)]
+    if covering:
+        return min(covering, key=rank)
+    return max(candidates, key=lambda f: (f['width'] * f['height'], f.get('protocol') == 'https'))
+
+def format_spec_for(fmt: Optional[dict]) -> Optional[str]:
+    """yt-dlp format spec that tries the chosen rendition first, then the default ladder."""
+    if not fmt or not fmt.get('format_id'):
+        return None
+    return f"{fmt['format_id']}/{YDL_FORMAT}/best"
 
 def download_twitter_video_og(url: str, output_path: str) -> str:
     """
@@ -33,26 +422,21 @@ def download_twitter_video_og(url: str, output_path: str) -> str:
         final_name = ydl.prepare_filename(info)
         return final_name
 
-def download_twitter_video(url, output_template, video_index=None):
+def download_twitter_video(url, output_template, video_index=None, post: Optional[PostInfo] = None, format_spec: Optional[str] = None):
     """
     Download one or all videos from a Twitter post using yt_dlp.
     If video_index is specified (1-based), only that specific clip is downloaded.
+    `post` reuses metadata already fetched; `format_spec` overrides the format.
     Returns:
         - str: path to the downloaded file if video_index is set
         - list[str]: all downloaded file paths otherwise
     """
-    ydl_opts = {
-        'quiet': True,
-        'noprogress': True,
-        'outtmpl': output_template,
-        'merge_output_format': 'mp4',
-        'format': 'bestvideo[height<=1080][ext=mp4]/best[height<=1080][ext=mp4]',
-    }
-
     downloaded_paths = []
+    if post is None:
+        post = PostInfo.fetch(url)
+    info = post.info
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
+    with _YDL_POOL.acquire(outtmpl=output_template, format_spec=format_spec) as ydl:
 
         # Handle playlists / multi-video posts
         if 'entries' in info:
@@ -89,26 +473,262 @@ def _safe_basename_from_url(url: str) -> str:
         ext = ".jpg"
     return re.sub(r"[^A-Za-z0-9._-]", "_", root) + ext
 
-def download_twitter_images(url: str, dest_dir: str) -> List[str]:
+class KeepAliveFetcher:
+    """
+    Downloads URLs over pooled keep-alive HTTP(S) connections, kept per host between
+    calls. Connection errors, 429 and 5xx responses are retried with backoff.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, timeout: float = 15, retries: int = 3, backoff: float = 0.5, max_idle_per_host: int = 8):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, timeout=self.timeout)
+
+    def _checkout(self, scheme: str, host: str):
+        """An idle connection to host, or a new one. Returns (conn, reused)."""
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        return self._connect(scheme, host), False
+
+    def _checkin(self, scheme: str, host: str, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def download(self, url: str, path: str) -> str:
+        """GET url into path (following up to 3 redirects). Returns path."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            target = url
+            try:
+                for _ in range(4):
+                    parsed = urllib.parse.urlsplit(target)
+                    conn, reused = self._checkout(parsed.scheme, parsed.netloc)
+                    reusable = False
+
+                    def send(conn: http.client.HTTPConnection) -> http.client.HTTPResponse:
+                        conn.request("GET", urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, "")), headers={
+                            "User-Agent": "Mozilla/5.0",
+                            "Connection": "keep-alive",
+                        })
+                        return conn.getresponse()
+
+                    try:
+                        try:
+                            resp = send(conn)
+                        except (http.client.HTTPException, OSError):
+                            if not reused:
+                                raise
+                            # The server closed the idle connection: retry at once on a
+                            # fresh one, without spending a retry or its backoff
+                            conn.close()
+                            conn = self._connect(parsed.scheme, parsed.netloc)
+                            resp = send(conn)
+                        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                            resp.read()
+                            reusable = not resp.will_close
+                            target = urllib.parse.urljoin(target, resp.getheader("Location"))
+                            continue
+                        if resp.status != 200:
+                            resp.read()
+                            reusable = not resp.will_close
+                            raise urllib.error.HTTPError(target, resp.status, resp.reason, resp.headers, None)
+                        with open(path, "wb") as out_file:
+                            shutil.copyfileobj(resp, out_file)
+                        reusable = not resp.will_close
+                        return path
+                    finally:
+                        if reusable:
+                            self._checkin(parsed.scheme, parsed.netloc, conn)
+                        else:
+                            conn.close()
+                raise urllib.error.URLError(f"Too many redirects for {url}")
+            except urllib.error.HTTPError as e:
+                if e.code not in self.RETRY_STATUSES:
+                    raise
+                last_error = e
+            except (http.client.HTTPException, OSError) as e:
+                last_error = e
+        raise last_error
+
+    def download_all(self, urls: List[str], paths: List[str], max_workers: int = 4) -> list:
+        """
+        Download urls[i] -> paths[i] concurrently. Returns a list in input order
+        holding either the path or the exception for that URL.
+        """
+        if not urls:
+            return []
+
+        def fetch(url: str, path: str):
+            try:
+                return self.download(url, path)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as pool:
+            return list(pool.map(fetch, urls, paths))
+
+_IMAGE_FETCHER = KeepAliveFetcher()
+
+# pbs.twimg.com size variants, smallest first, with the longest side each one
+# is downscaled to (None: the original upload)
+TWIMG_VARIANTS = (("small", 680), ("medium", 1200), ("large", 2048), ("orig", None))
+
+def _image_dimensions(path: str) -> Optional[tuple]:
+    """(width, height) read from a JPEG, PNG, WebP or GIF header, or None."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            if head.startswith(b"\x89PNG"):
+                return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+            if head[:6] in (b"GIF87a", b"GIF89a"):
+                return int.from_bytes(head[6:8], "little"), int.from_bytes(head[8:10], "little")
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                chunk = head[12:16]
+                if chunk == b"VP8X":
+                    return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+                if chunk == b"VP8L":
+                    bits = int.from_bytes(head[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b"VP8 ":
+                    return int.from_bytes(head[26:28], "little") & 0x3FFF, int.from_bytes(head[28:30], "little") & 0x3FFF
+                return None
+            if not head.startswith(b"\xff\xd8"):
+                return None
+            # JPEG: walk the segments up to the first start-of-frame marker
+            f.seek(2)
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0] != 0xFF:
+                    return None
+                kind, length = marker[1], int.from_bytes(marker[2:4], "big")
+                if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    return int.from_bytes(frame[3:5], "big"), int.from_bytes(frame[1:3], "big")
+                f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+def _image_variant_url(url: str, variant: str) -> str:
+    """url with its pbs.twimg.com size variant set to variant; other URLs are returned unchanged."""
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.netloc != "pbs.twimg.com" or not parsed.path.startswith("/media/"):
+        return url
+    # Legacy form: /media/ID.jpg:large
+    path = parsed.path.split(":")[0]
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parsed.query) if k != "name"]
+    query.append(("name", variant))
+    return urllib.parse.urlunsplit(parsed._replace(path=path, query=urllib.parse.urlencode(query)))
+
+class ImageSizeMap:
+    """
+    Pixel sizes of gallery images per post, learned from metadata and downloads, so
+    a later conversion picks its size variant without a probe download. Only the
+    max_posts most recently used posts are kept.
+    """
+
+    def __init__(self, max_posts: int = 1024):
+        self.max_posts = max_posts
+        self._posts = {}
+        self._lock = threading.Lock()
+
+    def _images(self, post_id: str, create: bool = False) -> Optional[dict]:
+        """The sizes of post_id, marked most recently used (dicts keep insertion order). Call under the lock."""
+        images = self._posts.pop(post_id, None)
+        if images is None:
+            if not create:
+                return None
+            images = {}
+        self._posts[post_id] = images
+        while len(self._posts) > self.max_posts:
+            del self._posts[next(iter(self._posts))]
+        return images
+
+    @staticmethod
+    def _key(url: str) -> str:
+        parsed = urllib.parse.urlsplit(url)
+        return parsed.netloc + parsed.path.split(":")[0]
+
+    def get(self, post_id: str, url: str) -> Optional[tuple]:
+        with self._lock:
+            images = self._images(post_id)
+            return images.get(self._key(url)) if images is not None else None
+
+    def record(self, post_id: str, url: str, width: int, height: int, bound: Optional[int] = None):
+        """Record a width x height download of url; bound is the variant's longest side (None: orig)."""
+        if not width or not height:
+            return
+        full = bound is None or max(width, height) < bound
+        with self._lock:
+            images = self._images(post_id, create=True)
+            known = images.get(self._key(url))
+            if known is None or full or not known[2]:
+                images[self._key(url)] = (width, height, full)
+
+    def variant(self, post_id: str, url: str, min_side: int) -> str:
+        """Smallest variant whose shorter side reaches min_side (or that is already the original)."""
+        size = self.get(post_id, url)
+        for name, bound in TWIMG_VARIANTS:
+            if bound is None:
+                return name
+            if size is None:
+                # Unknown aspect: enough for a square image, corrected after the download
+                if bound >= min_side:
+                    return name
+                continue
+            width, height, full = size
+            long_side, short_side = max(width, height), min(width, height)
+            if full and long_side <= bound:
+                return name
+            if bound * short_side / long_side >= min_side:
+                return name
+        return "orig"
+
+_IMAGE_SIZES = ImageSizeMap()
+
+def download_twitter_images(
+    url: str,
+    dest_dir: str,
+    post: Optional[PostInfo] = None,
+    fetcher=None,
+    min_side: Optional[int] = None,
+    sizes: Optional[ImageSizeMap] = None,
+) -> List[str]:
     """
     Attempt to extract and download all images from an X/Twitter post.
+    `post` reuses metadata already fetched, `fetcher` replaces the shared
+    KeepAliveFetcher, and `min_side` picks the smallest variant covering it.
     Returns a list of downloaded image file paths in order.
     """
     os.makedirs(dest_dir, exist_ok=True)
-    ydl_opts = {
-        'quiet': True,
-        'noprogress': True,
-        'skip_download': True,
-    }
     images: List[str] = []
     info = None
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-    except Exception as e:
-        print(f"yt-dlp info fetch failed for images: {e}")
+    if post is None:
+        try:
+            post = PostInfo.fetch(url)
+        except Exception as e:
+            print(f"yt-dlp info fetch failed for images: {e}")
+    if post is not None:
+        info = post.info
 
     candidates: List[str] = []
+    sizes = sizes or _IMAGE_SIZES
+    post_id = extract_post_id(url)
 
     def _collect_from(obj):
         if not isinstance(obj, dict):
@@ -124,6 +744,8 @@ def download_twitter_images(url: str, dest_dir: str) -> List[str]:
                     u = it.get('url') or it.get('thumbnail_url')
                     if u:
                         candidates.append(u)
+                        original = it.get('original_info') or {}
+                        sizes.record(post_id, u, original.get('width'), original.get('height'))
         if 'thumbnails' in obj and isinstance(obj['thumbnails'], list):
             best_by_id = {}
             for th in obj['thumbnails']:
@@ -192,49 +814,111 @@ def download_twitter_images(url: str, dest_dir: str) -> List[str]:
         print("No images detected in the tweet.")
         return []
 
-    for idx, u in enumerate(ordered_unique, start=1):
-        try:
-            name = _safe_basename_from_url(u)
-            name = f"{idx:02d}_" + name
-            outp = os.path.join(dest_dir, name)
-            print(f"Downloading image {idx}: {u}")
-            with urllib.request.urlopen(u, timeout=15) as response, open(outp, 'wb') as out_file:
-                shutil.copyfileobj(response, out_file)
-            images.append(outp)
-        except Exception as e:
-            print(f"Failed to download image {idx}: {e}")
+    paths = [
+        os.path.join(dest_dir, f"{idx:02d}_" + _safe_basename_from_url(u))
+        for idx, u in enumerate(ordered_unique, start=1)
+    ]
+    print(f"Downloading {len(ordered_unique)} images")
+    fetcher = fetcher or _IMAGE_FETCHER
+    if not min_side:
+        results = fetcher.download_all(ordered_unique, paths)
+    else:
+        bounds = dict(TWIMG_VARIANTS)
+        variants = [sizes.variant(post_id, u, min_side) for u in ordered_unique]
+        results = fetcher.download_all(
+            [_image_variant_url(u, v) for u, v in zip(ordered_unique, variants)], paths
+        )
+        # Images of unknown aspect were fetched for a square; learn their size
+        # and fetch the few that fall short again at the variant that covers
+        retry = []
+        for i, (u, v, result) in enumerate(zip(ordered_unique, variants, results)):
+            if isinstance(result, Exception):
+                continue
+            size = _image_dimensions(result)
+            if size is None:
+                continue
+            sizes.record(post_id, u, size[0], size[1], bounds[v])
+            better = sizes.variant(post_id, u, min_side)
+            if better != v:
+                retry.append((i, v))
+                variants[i] = better
+        if retry:
+            print(f"Refetching {len(retry)} images at a larger size")
+            # Into side files, so a failed refetch still leaves the smaller image
+            refetched = fetcher.download_all(
+                [_image_variant_url(ordered_unique[i], variants[i]) for i, _ in retry],
+                [paths[i] + ".part" for i, _ in retry],
+            )
+            for (i, previous), result in zip(retry, refetched):
+                if isinstance(result, Exception):
+                    print(f"Failed to refetch image {i + 1}, keeping the smaller one: {result}")
+                    variants[i] = previous
+                    continue
+                os.replace(result, paths[i])
+                size = _image_dimensions(paths[i])
+                if size is not None:
+                    sizes.record(post_id, ordered_unique[i], size[0], size[1], bounds[variants[i]])
+        print("Image variants: " + ", ".join(variants))
+    for idx, (u, result) in enumerate(zip(ordered_unique, results), start=1):
+        if isinstance(result, Exception):
+            print(f"Failed to download image {idx}: {result}")
+        else:
+            images.append(result)
     return images
 
-def build_slideshow_video(images: List[str], output_mp4: str, fps: int = 30, seconds_per_image: float = 2.0) -> str:
+def _slideshow_clip_filter(fps: int, seconds_per_image: float) -> str:
+    """The 720x720 zoompan filter build_slideshow_video renders each image's clip with."""
+    return (
+        f"scale=720:720:force_original_aspect_ratio=increase,"
+        f"crop=720:720,"
+        f"zoompan=z='min(zoom+0.0015,1.05)':d={int(seconds_per_image*fps)}:s=720x720:fps={fps}"
+    )
+
+def build_slideshow_video(
+    images: List[str],
+    output_mp4: str,
+    fps: int = 30,
+    seconds_per_image: float = 2.0,
+    max_workers: Optional[int] = None,
+) -> str:
     """
     Build a slideshow MP4 from a list of images with a subtle zoom effect.
+    Per-image clips are rendered concurrently (up to max_workers, default the
+    CPU count) and concatenated in input order.
     """
     if not images:
         raise ValueError("No images provided for slideshow")
     _require_cmd("ffmpeg")
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(len(images), max_workers or cpu_count))
+    # Split the cores between concurrent encodes instead of oversubscribing them
+    threads_per_clip = max(1, cpu_count // workers)
+
+    def render_clip(img: str, clip: str) -> float:
+        # A single input frame: zoompan expands it to exactly d output frames
+        # (looping the image would make zoompan emit d frames per looped frame)
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", img,
+            "-vf", _slideshow_clip_filter(fps, seconds_per_image),
+            "-an",
+            "-r", str(fps),
+            "-pix_fmt", "yuv420p",
+            "-threads", str(threads_per_clip),
+            clip,
+        ]
+        started = time.monotonic()
+        with span("slideshow_clip", image=os.path.basename(img)):
+            _run(cmd, check=True)
+        return time.monotonic() - started
+
     with tempfile.TemporaryDirectory(prefix="x_gallery_") as tmp_dir:
-        clip_paths: List[str] = []
-        for i, img in enumerate(images, start=1):
-            clip = os.path.join(tmp_dir, f"clip_{i:02d}.mp4")
-            vf = (
-                f"scale=720:720:force_original_aspect_ratio=increase,"
-                f"crop=720:720,"
-                f"zoompan=z='min(zoom+0.0015,1.05)':d={int(seconds_per_image*fps)}:s=720x720:fps={fps}"
-            )
-            cmd = [
-                "ffmpeg", "-y",
-                "-loop", "1",
-                "-t", f"{seconds_per_image}",
-                "-i", img,
-                "-vf", vf,
-                "-an",
-                "-r", str(fps),
-                "-pix_fmt", "yuv420p",
-                clip,
-            ]
-            print(f"Creating clip for {os.path.basename(img)}")
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            clip_paths.append(clip)
+        clip_paths = [os.path.join(tmp_dir, f"clip_{i:02d}.mp4") for i in range(1, len(images) + 1)]
+        print(f"Creating {len(images)} clips on {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [_job_submit(pool, render_clip, img, clip) for img, clip in zip(images, clip_paths)]
+            for img, future in zip(images, futures):
+                print(f"Created clip for {os.path.basename(img)} in {future.result():.2f}s")
 
         list_path = os.path.join(tmp_dir, "list.txt")
         with open(list_path, "w", encoding="utf-8") as f:
@@ -249,9 +933,118 @@ def build_slideshow_video(images: List[str], output_mp4: str, fps: int = 30, sec
             output_mp4,
         ]
         print("Concatenating image clips into slideshow")
-        subprocess.run(cmd_concat, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _run(cmd_concat, check=True)
         return output_mp4
 
+def build_slideshow_webp(
+    images: List[str],
+    output_webp: str,
+    max_size: int = 300,
+    fps: int = 30,
+    webp_quality: int = 85,
+    seconds_per_image: float = 2.0,
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    quality_boost: bool = False,
+    decimate: bool = False,
+    min_quality: int = 50,
+):
+    """
+    Encode an image gallery to an animated WebP in one ffmpeg call (see
+    _slideshow_graph). start_s/end_s trim the joined slideshow in seconds.
+    """
+    if not images:
+        raise ValueError("No images provided for slideshow")
+    _require_cmd("ffmpeg")
+    cmd = _slideshow_webp_cmd(
+        images, max_size, fps, webp_quality, seconds_per_image, start_s, end_s, quality_boost, decimate, min_quality)
+    print(f"Encoding {len(images)} images to WebP slideshow")
+    with span("slideshow", images=len(images)):
+        result = _run_webp_encode(cmd, output_webp)
+    if decimate:
+        result = _hold_last_frame(result, _slideshow_seconds(len(images), seconds_per_image, start_s, end_s))
+    return result
+
+def _slideshow_seconds(count: int, seconds_per_image: float, start_s: Optional[float], end_s: Optional[float]) -> float:
+    end = count * seconds_per_image if end_s is None else min(end_s, count * seconds_per_image)
+    return end - (start_s or 0.0)
+
+def _slideshow_webp_cmd(
+    images: List[str],
+    max_size: int,
+    fps: int,
+    webp_quality: int,
+    seconds_per_image: float,
+    start_s: Optional[float],
+    end_s: Optional[float],
+    quality_boost: bool,
+    decimate: bool = False,
+    min_quality: int = 50,
+) -> List[str]:
+    """The build_slideshow_webp ffmpeg command, without the output."""
+    cmd = ["ffmpeg", "-y"]
+    for img in images:
+        cmd.extend(["-i", img])
+    graph = _slideshow_graph(len(images), max_size, fps, seconds_per_image, start_s, end_s, quality_boost, decimate)
+    cmd.extend(["-filter_complex", graph, "-map", "[out]"])
+    if decimate:
+        cmd.extend(["-fps_mode", "vfr"])
+    cmd.extend(_webp_encode_args(webp_quality, min_quality=min_quality))
+    return cmd
+
+# Ken Burns zoom of every slideshow image: from 1.0 to SLIDESHOW_MAX_ZOOM at
+# SLIDESHOW_ZOOM_RATE per second, then held
+SLIDESHOW_MAX_ZOOM = 1.05
+SLIDESHOW_ZOOM_RATE = 0.09
+
+def _slideshow_graph(
+    count: int,
+    max_size: int,
+    fps: int,
+    seconds_per_image: float,
+    start_s: Optional[float],
+    end_s: Optional[float],
+    quality_boost: bool,
+    decimate: bool = False,
+    label: str = "out",
+    even: bool = False,
+) -> str:
+    """
+    Filtergraph scaling inputs 0..count-1 to the max_size square, zooming each up
+    to SLIDESHOW_MAX_ZOOM and holding it, and joining them into [label].
+    """
+    side = max_size - max_size % 2 if even else max_size
+    frames = max(1, int(seconds_per_image * fps))
+    zoom_frames = min(frames, int((SLIDESHOW_MAX_ZOOM - 1) / SLIDESHOW_ZOOM_RATE * fps) + 2)
+    zoom = f"min(1+{SLIDESHOW_ZOOM_RATE}*in/({fps})\\,{SLIDESHOW_MAX_ZOOM})"
+    near, far = f"(1-1/{zoom})/2", f"(1+1/{zoom})/2"
+    corners = ":".join(
+        f"x{i}='W*{x}':y{i}='H*{y}'"
+        for i, (x, y) in enumerate([(near, near), (far, near), (near, far), (far, far)])
+    )
+
+    parts = []
+    for i in range(count):
+        parts.append(
+            f"[{i}:v]scale={side}:{side}:force_original_aspect_ratio=increase:flags=lanczos,crop={side}:{side},setsar=1,"
+            f"loop=loop={zoom_frames - 1}:size=1,perspective={corners}:interpolation=cubic:eval=frame,"
+            f"loop=loop={frames - zoom_frames}:size=1:start={zoom_frames - 1},setpts=N/(({fps})*TB),fps={fps}[v{i}]"
+        )
+    tail = [f"concat=n={count}:v=1:a=0"]
+    if start_s is not None or end_s is not None:
+        bounds = []
+        if start_s is not None:
+            bounds.append(f"start={start_s}")
+        if end_s is not None:
+            bounds.append(f"end={end_s}")
+        tail.append("trim=" + ":".join(bounds))
+        tail.append("setpts=PTS-STARTPTS")
+    if quality_boost:
+        tail.append("hqdn3d=1.2:1.2:6:6")
+    if decimate:
+        tail.append(DECIMATE_FILTER)
+    return ";".join(parts) + ";" + "".join(f"[v{i}]" for i in range(count)) + ",".join(tail) + f"[{label}]"
+
 def _require_cmd(cmd: str):
     if shutil.which(cmd) is None:
         raise RuntimeError(
@@ -284,39 +1077,201 @@ def _build_crop_filter(crop_angle: str) -> str:
         xy = "x=(iw-min(iw\\,ih))/2:y=ih-min(iw\\,ih)"
     return f"crop=w={w_h}:h={w_h}:{xy}"
 
-def _get_video_fps(input_video: str) -> int:
-    """Get the FPS of the input video using FFmpeg."""
-    cmd = [
-        "ffmpeg",
-        "-i", input_video,
-        "-vf", "fpsprobesidechain=none",
-        "-f", "null",
-        "-"
-    ]
-    result = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-    stderr = result.stderr.decode('utf-8', errors='ignore')
+def _scale_filter(max_size: int, even: bool = False) -> str:
+    """Fit within max_size x max_size, never upscaling; even rounds down to even dimensions."""
+    scale = f"scale=w=min(iw\\,{max_size}):h=min(ih\\,{max_size}):force_original_aspect_ratio=decrease:flags=lanczos"
+    return scale + ":force_divisible_by=2" if even else scale
 
-    # Extract FPS from FFmpeg output
-    fps_match = re.search(r"(\d+(?:\.\d+)?) fps", stderr)
-    if fps_match:
-        return int(float(fps_match.group(1)))
-    return 0
+class MediaInfo:
+    """Container/stream facts for one input, read from headers only (no decode)."""
 
-def _get_video_duration(input_video: str) -> float:
-    """Get the duration of the input video in seconds using FFmpeg."""
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        input_video
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    duration = result.stdout.decode('utf-8', errors='ignore').strip()
+    def __init__(
+        self,
+        fps: Fraction = Fraction(0),
+        duration: float = 0.0,
+        width: int = 0,
+        height: int = 0,
+        codec: Optional[str] = None,
+        rotation: int = 0,
+        has_audio: bool = False,
+    ):
+        self.fps = fps
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.rotation = rotation
+        self.has_audio = has_audio
+
+    @property
+    def display_size(self):
+        """(width, height) after applying the rotation metadata."""
+        if self.rotation % 180:
+            return self.height, self.width
+        return self.width, self.height
+
+    @classmethod
+    def from_format(cls, fmt: dict, duration: Optional[float] = None) -> "MediaInfo":
+        """Build from a yt-dlp format dict, for remote input we do not want to probe."""
+        fps = fmt.get('fps')
+        return cls(
+            fps=Fraction(fps).limit_denominator(1001) if fps else Fraction(0),
+            duration=float(duration or fmt.get('duration') or 0.0),
+            width=int(fmt.get('width') or 0),
+            height=int(fmt.get('height') or 0),
+            codec=(fmt.get('vcodec') or '').split('.')[0] or None,
+            has_audio=fmt.get('acodec') not in (None, 'none'),
+        )
+
+    def __repr__(self):
+        return (
+            f"MediaInfo(fps={self.fps}, duration={self.duration}, size={self.width}x{self.height}, "
+            f"codec={self.codec}, rotation={self.rotation}, has_audio={self.has_audio})"
+        )
+
+def _parse_rate(rate: Optional[str]) -> Fraction:
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return Fraction(0)
+    return value if value > 0 else Fraction(0)
+
+def _probe_cmd(input_video: str, input_headers: Optional[dict] = None) -> List[str]:
+    cmd = ["ffprobe", "-v", "error"]
+    if input_headers:
+        cmd.extend(["-headers", "".join(f"{k}: {v}\r\n" for k, v in input_headers.items())])
+    cmd.extend([
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        input_video,
+    ])
+    return cmd
+
+def probe_media(input_video: str, input_headers: Optional[dict] = None) -> MediaInfo:
+    """Read container and stream headers with a single ffprobe call."""
+    _require_cmd("ffprobe")
+    with span("probe"):
+        return _parse_probe(_run(_probe_cmd(input_video, input_headers)).stdout)
+
+def _parse_probe(output: bytes) -> MediaInfo:
+    """Build a MediaInfo from ffprobe's JSON output (empty when it failed)."""
+    try:
+        data = json.loads(output.decode('utf-8', errors='ignore') or "{}")
+    except ValueError:
+        data = {}
+
+    streams = data.get('streams') or []
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    info = MediaInfo(
+        fps=_parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+        width=int(video.get('width') or 0),
+        height=int(video.get('height') or 0),
+        codec=video.get('codec_name'),
+        has_audio=any(st.get('codec_type') == 'audio' for st in streams),
+    )
+    for value in (data.get('format') or {}).get('duration'), video.get('duration'):
+        try:
+            info.duration = float(value)
+            break
+        except (TypeError, ValueError):
+            continue
+
+    rotation = (video.get('tags') or {}).get('rotate')
+    for side_data in video.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            rotation = side_data['rotation']
     try:
-        return float(duration)
+        info.rotation = int(float(rotation)) % 360 if rotation is not None else 0
     except ValueError:
-        return 0.0
+        pass
+    return info
+
+def _fix_piped_webp(data: bytes) -> bytes:
+    """
+    ffmpeg's WebP muxer cannot seek back on a pipe: it leaves the RIFF size as 0
+    and appends the size after the last chunk instead. Move it into the header.
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[4:8] != b"\0\0\0\0":
+        return data
+    if int.from_bytes(data[-4:], "little") == len(data) - 12:
+        data = data[:-4]
+    return data[:4] + (len(data) - 8).to_bytes(4, "little") + data[8:]
+
+# Drops frames that barely differ from the last kept one; with -fps_mode vfr the
+# kept frame is shown for as long as the dropped ones would have been
+DECIMATE_FILTER = "mpdecimate"
+
+def _time_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds from an MM:SS time or a plain number of seconds."""
+    if not value:
+        return None
+    return float(parse_time(value)) if ":" in value else float(value)
+
+def _clip_seconds(start_time: Optional[str], end_time: Optional[str], media_info: Optional[MediaInfo]) -> Optional[float]:
+    end_s = _time_seconds(end_time)
+    if media_info is not None and media_info.duration:
+        # ffmpeg stops at EOF, so an end past it does not lengthen the clip
+        end_s = media_info.duration if end_s is None else min(end_s, media_info.duration)
+    return end_s - (_time_seconds(start_time) or 0.0) if end_s else None
+
+def _hold_last_frame(result, seconds: Optional[float]):
+    """
+    A decimated encode may end in a run of dropped duplicates, which ffmpeg
+    cannot time: the last frame gets one frame interval. Stretch the last ANMF
+    frame so the animation lasts `seconds`. result is WebP bytes or a file path.
+    """
+    if not seconds:
+        return result
+    data = result
+    if not isinstance(result, (bytes, bytearray)):
+        with open(result, "rb") as f:
+            data = f.read()
+    last, total_ms, pos = None, 0, 12
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos + 4:pos + 8], "little")
+        if data[pos:pos + 4] == b"ANMF":
+            last = pos
+            total_ms += int.from_bytes(data[pos + 20:pos + 23], "little")
+        pos += 8 + size + (size & 1)
+    missing = int(round(seconds * 1000)) - total_ms
+    if last is None or missing <= 0:
+        return result
+    duration = min(0xFFFFFF, int.from_bytes(data[last + 20:last + 23], "little") + missing)
+    data = data[:last + 20] + duration.to_bytes(3, "little") + data[last + 23:]
+    if isinstance(result, (bytes, bytearray)):
+        return data
+    with open(result, "wb") as f:
+        f.write(data)
+    return result
+
+def _run_webp_encode(cmd: List[str], output_webp: str, stdin=None):
+    """
+    Run an ffmpeg WebP encode whose output options are already in cmd. As for every
+    encode here, output "-" keeps the result in memory and returns it as bytes.
+    """
+    if output_webp == "-":
+        result = _run(cmd + ["pipe:1"], check=True, stdin=stdin)
+        return _fix_piped_webp(result.stdout)
+    _run(cmd + [output_webp], check=True, stdin=stdin)
+    return output_webp
+
+def _webp_encode_args(webp_quality: int, lossless: bool = False, min_quality: int = 50) -> List[str]:
+    """Output options shared by every animated WebP encode."""
+    args = [
+        "-loop", "0",
+        "-c:v", "libwebp",
+        "-compression_level", str(WEBP_COMPRESSION_LEVEL),
+        "-q:v", str(min(70, max(min_quality, webp_quality))),
+        "-f", "webp",
+        "-metadata", "loop=0",
+    ]
+    # libwebp applies -preset after the other options and it resets lossless
+    if lossless:
+        args.extend(["-lossless", "1"])
+    else:
+        args.extend(["-preset", "default"])
+    return args
 
 def convert_video_to_webp(
     input_video: str,
@@ -329,20 +1284,96 @@ def convert_video_to_webp(
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
     quality_boost: bool = False,
+    input_headers: Optional[dict] = None,
+    media_info: Optional[MediaInfo] = None,
+    stdin=None,
+    min_quality: int = 50,
+    frames: Optional[int] = None,
+    decimate: bool = False,
 ):
+    """
+    Encode input_video (a path, a URL, or "pipe:0" with stdin) to an animated WebP.
+    The trim is applied as input options, so remote input is only read where needed.
+    """
     _require_cmd("ffmpeg")
 
-    # Get video's actual FPS
-    video_fps = _get_video_fps(input_video)
-    print(f"Video FPS: {video_fps}, Config FPS: {fps}")
+    # Get video's actual FPS (a pipe cannot be probed ahead of the encode)
+    if media_info is None:
+        media_info = probe_media(input_video, input_headers) if stdin is None else MediaInfo()
+    cmd = _video_webp_cmd(
+        input_video, media_info, max_size, fps, webp_quality, lossless, crop_angle,
+        start_time, end_time, quality_boost, input_headers, min_quality, frames, decimate,
+    )
+    with span("encode", start=start_time, end=end_time, quality=webp_quality):
+        result = _run_webp_encode(cmd, output_webp, stdin=stdin)
+    if decimate:
+        result = _hold_last_frame(result, _clip_seconds(start_time, end_time, media_info))
+    return result
+
+def _video_webp_cmd(
+    input_video: str,
+    media_info: MediaInfo,
+    max_size: int,
+    fps: int,
+    webp_quality: int,
+    lossless: bool,
+    crop_angle: Optional[str],
+    start_time: Optional[str],
+    end_time: Optional[str],
+    quality_boost: bool,
+    input_headers: Optional[dict],
+    min_quality: int,
+    frames: Optional[int],
+    decimate: bool = False,
+) -> List[str]:
+    """The convert_video_to_webp ffmpeg command, without the output."""
+    chain = ",".join(_video_filters(media_info, max_size, fps, crop_angle, quality_boost, decimate))
+    cmd = _video_input_args(input_video, start_time, end_time, input_headers)
+    cmd.extend(["-vf", chain])
+    #"-sws_flags", "lanczos+accurate_rnd+full_chroma_int",
+    if frames:
+        cmd.extend(["-frames:v", str(frames)])
+    if decimate:
+        cmd.extend(["-fps_mode", "vfr"])
+    cmd.extend(_webp_encode_args(webp_quality, lossless, min_quality))
+    return cmd
+
+def _video_input_args(
+    input_video: str,
+    start_time: Optional[str],
+    end_time: Optional[str],
+    input_headers: Optional[dict],
+) -> List[str]:
+    """ffmpeg arguments up to and including the input, with the trim as input options."""
+    cmd = ["ffmpeg", "-y"]
+    if input_headers:
+        cmd.extend(["-headers", "".join(f"{k}: {v}\r\n" for k, v in input_headers.items())])
+    if start_time:
+        cmd.extend(["-ss", start_time])
+    if end_time:
+        cmd.extend(["-to", end_time])
+    cmd.extend(["-i", input_video])
+    return cmd
 
+def _video_filters(
+    media_info: MediaInfo,
+    max_size: int,
+    fps: int,
+    crop_angle: Optional[str],
+    quality_boost: bool,
+    decimate: bool = False,
+    even: bool = False,
+) -> List[str]:
+    """
+    fps, crop, denoise and scale filters shared by every video encode. even
+    rounds the output size down to even dimensions (for 4:2:0 video codecs).
+    """
     # Use the lower FPS to avoid creating duplicate frames
-    if video_fps > 0 and video_fps < fps:
-        fps = video_fps
-        print(f"Adjusting FPS to match video: {fps}")
+    if 0 < media_info.fps < fps:
+        fps = media_info.fps
 
     crop_filter = _build_crop_filter(crop_angle) if crop_angle and crop_angle.upper() in {"LEFT", "RIGHT", "TOP", "BOTTOM", "CENTER"} else None
-    scale_filter = f"scale=w=min(iw\\,{max_size}):h=min(ih\\,{max_size}):force_original_aspect_ratio=decrease:flags=lanczos"
+    scale_filter = _scale_filter(max_size, even)
 
     v_filters = [f"fps={fps}"]
     if crop_filter:
@@ -350,66 +1381,1193 @@ def convert_video_to_webp(
     if quality_boost:
         v_filters.append("hqdn3d=1.2:1.2:6:6")
     v_filters.append(scale_filter)
-    chain = ",".join(v_filters)
+    if decimate:
+        v_filters.append(DECIMATE_FILTER)
+    return v_filters
 
-    cmd = ["ffmpeg", "-y"]
-    if start_time:
-        cmd.extend(["-ss", start_time])
-    if end_time:
-        cmd.extend(["-to", end_time])
-    cmd.extend(["-i", input_video])
-    cmd.extend([
-        "-vf", chain,
-        #"-sws_flags", "lanczos+accurate_rnd+full_chroma_int",
-        "-loop", "0",
-        "-c:v", "libwebp",
-        "-compression_level", "3",
-        "-q:v", str(min(70, max(50, webp_quality))),
-        "-preset", "default",
-        "-f", "webp",
-        "-metadata", "loop=0"
-    ])
-    if lossless:
-        cmd.extend(["-lossless", "1"])
-    cmd.append(output_webp)
+def _webp_chunks(data: bytes):
+    """Yield (fourcc, payload) for each top-level chunk of a RIFF WebP file."""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        raise ValueError("Not a WebP file")
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        size = int.from_bytes(data[pos + 4:pos + 8], "little")
+        yield fourcc, data[pos + 8:pos + 8 + size]
+        pos += 8 + size + (size & 1)
 
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def join_animated_webp(parts: List[bytes]) -> bytes:
+    """
+    Concatenate animated WebPs with the same canvas into one animation; the header
+    comes from the first part and every frame keeps its own duration.
+    """
+    head, frames, tail = [], [], []
+    flags = 0
+    for i, part in enumerate(parts):
+        seen_frame = False
+        for fourcc, payload in _webp_chunks(part):
+            if fourcc == b"VP8X":
+                flags |= payload[0]
+                if i == 0:
+                    head.append([fourcc, bytearray(payload)])
+            elif fourcc == b"ANMF":
+                seen_frame = True
+                frames.append((fourcc, payload))
+            elif i == 0:
+                (tail if seen_frame else head).append([fourcc, payload])
+    for chunk in head:
+        if chunk[0] == b"VP8X":
+            chunk[1][0] = flags
 
-def extract_post_id(url: str) -> str:
-    parsed = urlparse(url)
-    path = parsed.path
-    parts = [p for p in path.split('/') if p]
-    for part in reversed(parts):
-        if part.isdigit():
-            return part
-    m = re.search(r"(\d+)", parsed.geturl())
-    return m.group(1) if m else "post"
+    body = bytearray(b"WEBP")
+    for fourcc, payload in [*head, *frames, *tail]:
+        body += fourcc + len(payload).to_bytes(4, "little") + payload
+        if len(payload) & 1:
+            body += b"\0"
+    return b"RIFF" + len(body).to_bytes(4, "little") + bytes(body)
 
-def is_image_only_post(info) -> bool:
-    """Heuristic to detect if post has only images and no video."""
-    if not isinstance(info, dict):
-        return False
-    entries = info.get('entries', [info]) if 'entries' in info else [info]
-    for entry in entries:
-        if not isinstance(entry, dict):
-            continue
-        if entry.get('duration') or entry.get('formats'):
-            return False
-        media = entry.get('media') or []
-        for m in media:
-            if m.get('type') == 'video':
-                return False
-    return True
+def _frame_grid(fps: int, start_time: Optional[str], end_time: Optional[str], media_info: MediaInfo):
+    """Output fps and start/end seconds of the trim window; the end is clamped to a known duration."""
+    out_fps = min(Fraction(fps), media_info.fps) if media_info.fps else Fraction(fps)
+    start_s = parse_time(start_time) if start_time else 0.0
+    end_s = parse_time(end_time) if end_time else media_info.duration
+    if media_info.duration:
+        # An end past EOF would plan windows that start after the last frame
+        end_s = min(end_s, media_info.duration)
+    return out_fps, start_s, end_s
 
-def build_preset(name: str):
-    name = name.lower()
-    if name == "fast":
-        return dict(fps=12, colors=128, dither="bayer:bayer_scale=3", stats_mode_full=False, quality_boost=False, webp_quality=75, webp_lossless=False, max_size=300)
-    if name == "medium":
-        return dict(fps=16, colors=200, dither="sierra2_4a", stats_mode_full=True, quality_boost=False, webp_quality=80, webp_lossless=False, max_size=300)
-    return dict(fps=30, colors=256, dither="sierra2_4a", stats_mode_full=True, quality_boost=False, webp_quality=90, webp_lossless=False, max_size=400)
+def _frame_windows(bounds: List[Optional[int]], out_fps: Fraction, start_s: float, end_s: float):
+    """
+    [(start_time, end_time, frames)] between consecutive frame indexes in
+    bounds; a last bound of None runs to the end of the input.
+    """
+    windows = []
+    for first, last in zip(bounds, bounds[1:]):
+        window_start = f"{float(start_s + first / out_fps):.6f}"
+        if last is None:
+            windows.append((window_start, None, None))
+            continue
+        # Read one extra frame interval so the fps filter can fill the last frame
+        window_end = start_s + (last + 1) / out_fps
+        if end_s:
+            window_end = min(end_s, window_end)
+        windows.append((window_start, f"{float(window_end):.6f}", last - first))
+    return windows
 
-def parse_time(time_str: str) -> int:
+def _chunk_plan(
+    fps: int,
+    start_time: Optional[str],
+    end_time: Optional[str],
+    media_info: MediaInfo,
+    workers: Optional[int],
+    min_chunk_seconds: float,
+):
+    """
+    Cut the trimmed timeline on the output frame grid into up to `workers`
+    chunks of at least min_chunk_seconds. Returns [(start_time, end_time,
+    frames)] per chunk, or None when the clip is too short to split.
+    """
+    out_fps, start_s, end_s = _frame_grid(fps, start_time, end_time, media_info)
+    clip_seconds = end_s - start_s if end_s else 0.0
+
+    workers = workers or os.cpu_count() or 1
+    chunks = max(1, min(workers, int(clip_seconds // min_chunk_seconds)))
+    if chunks == 1:
+        return None
+
+    total_frames = int(clip_seconds * out_fps)
+    bounds = [total_frames * k // chunks for k in range(chunks + 1)]
+    print(f"Encoding {total_frames} frames in {chunks} parallel chunks")
+    return _frame_windows(bounds, out_fps, start_s, end_s)
+
+def convert_video_to_webp_parallel(
+    input_video: str,
+    output_webp: str,
+    fps: int = 20,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    media_info: Optional[MediaInfo] = None,
+    workers: Optional[int] = None,
+    min_chunk_seconds: float = 1.0,
+    **kwargs,
+):
+    """
+    convert_video_to_webp split into up to `workers` chunks (see _chunk_plan),
+    encoded concurrently and joined with join_animated_webp().
+    """
+    if media_info is None:
+        media_info = probe_media(input_video, kwargs.get('input_headers'))
+    # Decimated output has no fixed frame count per chunk, so it is encoded in one pass
+    plan = None if kwargs.get('decimate') else _chunk_plan(fps, start_time, end_time, media_info, workers, min_chunk_seconds)
+    if plan is None:
+        return convert_video_to_webp(
+            input_video, output_webp, fps=fps, start_time=start_time, end_time=end_time,
+            media_info=media_info, **kwargs,
+        )
+
+    def encode_chunk(chunk) -> bytes:
+        chunk_start, chunk_end, frames = chunk
+        return convert_video_to_webp(
+            input_video, "-", fps=fps, start_time=chunk_start, end_time=chunk_end,
+            media_info=media_info, frames=frames, **kwargs,
+        )
+
+    with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+        parts = [f.result() for f in [_job_submit(pool, encode_chunk, chunk) for chunk in plan]]
+    data = join_animated_webp(parts)
+
+    if output_webp == "-":
+        return data
+    with open(output_webp, "wb") as f:
+        f.write(data)
+    return output_webp
+
+DISCORD_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+# Budget search rungs, best looking first: (fps factor, scale factor, quality or None = preset)
+BUDGET_LADDER = [
+    (1.0, 1.0, None),
+    (1.0, 1.0, 50),
+    (0.5, 1.0, 50),
+    (0.5, 0.75, 45),
+    (0.5, 0.5, 40),
+    (1 / 3, 0.5, 30),
+]
+
+def _budget_rung(i: int, fps: int, max_size: int, webp_quality: int) -> dict:
+    """Encode settings of BUDGET_LADDER rung i for a preset's fps, size and quality."""
+    fps_factor, scale_factor, quality = BUDGET_LADDER[i]
+    return dict(
+        fps=max(8, int(round(float(fps) * fps_factor))),
+        max_size=max(64, int(max_size * scale_factor)),
+        webp_quality=webp_quality if quality is None else quality,
+        min_quality=min(50, quality) if quality is not None else 50,
+    )
+
+def convert_video_to_webp_budget(
+    input_video: str,
+    output_webp: str,
+    target_bytes: int = DISCORD_UPLOAD_LIMIT,
+    max_size: int = 300,
+    fps: int = 20,
+    webp_quality: int = 85,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    media_info: Optional[MediaInfo] = None,
+    sample_seconds: float = 1.0,
+    max_full_encodes: int = 2,
+    **kwargs,
+):
+    """
+    convert_video_to_webp with an output size budget: ~1 s samples of BUDGET_LADDER
+    rungs predict the full size, and the best rung predicted to fit is encoded (the
+    next one only if it misses). If nothing fits, the smallest attempt is returned.
+    """
+    if media_info is None:
+        media_info = probe_media(input_video, kwargs.get('input_headers'))
+    if media_info.fps:
+        fps = min(fps, media_info.fps)
+    start_s = parse_time(start_time) if start_time else 0.0
+    end_s = parse_time(end_time) if end_time else (media_info.duration or start_s + DEFAULT_CLIP_SECONDS)
+    if media_info.duration:
+        # Past EOF the sample would land after the last frame and predict 0 bytes
+        end_s = min(end_s, media_info.duration)
+    clip_seconds = max(0.1, end_s - start_s)
+    sample_seconds = min(sample_seconds, clip_seconds)
+    sample_start = start_s + (clip_seconds - sample_seconds) / 2
+    safety = 0.92  # headroom for extrapolation error
+
+    def rung_params(i: int) -> dict:
+        return _budget_rung(i, fps, max_size, webp_quality)
+
+    def predict(i: int) -> float:
+        sample = convert_video_to_webp(
+            input_video, "-",
+            start_time=f"{sample_start:.3f}",
+            end_time=f"{sample_start + sample_seconds:.3f}",
+            media_info=media_info,
+            **rung_params(i), **kwargs,
+        )
+        predicted = len(sample) / sample_seconds * clip_seconds
+        print(f"Budget rung {i}: {rung_params(i)} -> predicted {predicted / 1024:.0f} KiB")
+        return predicted
+
+    # Rungs shrink monotonically: try the preset first, then binary search the rest
+    if predict(0) <= target_bytes * safety:
+        rung = 0
+    else:
+        lo, hi = 1, len(BUDGET_LADDER) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if predict(mid) <= target_bytes * safety:
+                hi = mid
+            else:
+                lo = mid + 1
+        rung = lo
+
+    best = None
+    for attempt in range(max_full_encodes):
+        params = rung_params(rung)
+        data = convert_video_to_webp(
+            input_video, "-",
+            start_time=start_time, end_time=end_time,
+            media_info=media_info, **params, **kwargs,
+        )
+        print(f"Budget encode {attempt + 1}: {len(data) / 1024:.0f} KiB (target {target_bytes / 1024:.0f} KiB)")
+        if best is None or len(data) < len(best):
+            best = data
+        if len(data) <= target_bytes or rung == len(BUDGET_LADDER) - 1:
+            break
+        rung += 1
+
+    if output_webp == "-":
+        return best
+    with open(output_webp, "wb") as f:
+        f.write(best)
+    return output_webp
+
+def build_slideshow_webp_budget(
+    images: List[str],
+    output_webp: str,
+    target_bytes: int = DISCORD_UPLOAD_LIMIT,
+    max_size: int = 300,
+    fps: int = 30,
+    webp_quality: int = 85,
+    **kwargs,
+):
+    """
+    build_slideshow_webp with an output size budget. Slideshows are too short to
+    sample, so BUDGET_LADDER rungs are encoded in full; returns the best that fits.
+    """
+    attempts = {}
+
+    def encode(i: int) -> bytes:
+        if i not in attempts:
+            attempts[i] = build_slideshow_webp(images, "-", **_budget_rung(i, fps, max_size, webp_quality), **kwargs)
+            print(f"Budget rung {i}: {len(attempts[i]) / 1024:.0f} KiB (target {target_bytes / 1024:.0f} KiB)")
+        return attempts[i]
+
+    if len(encode(0)) > target_bytes:
+        lo, hi = 1, len(BUDGET_LADDER) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if len(encode(mid)) <= target_bytes:
+                hi = mid
+            else:
+                lo = mid + 1
+        encode(lo)
+    fitting = [i for i, data in attempts.items() if len(data) <= target_bytes]
+    best = attempts[min(fitting)] if fitting else min(attempts.values(), key=len)
+    return _write_output(best, output_webp)
+
+# GIF frame delays are whole centiseconds and browsers slow anything under
+# 2 cs down to 10 cs, so 50 fps is the fastest rate that plays as encoded.
+GIF_MAX_FPS = 50
+# Per-scene palettes: cuts closer together than this are merged, and at most
+# GIF_MAX_SCENES palettes are built (the strongest cuts win).
+GIF_MIN_SCENE_SECONDS = 0.5
+GIF_MAX_SCENES = 16
+
+def _gif_palette_graph(source: str, colors: int = 256, dither: str = "sierra2_4a", stats_mode_full: bool = True) -> str:
+    """
+    Filtergraph quantizing [source] to a GIF palette in the same pass (split,
+    palettegen, paletteuse), labelled [out].
+    """
+    gen = f"palettegen=max_colors={colors}:stats_mode={'full' if stats_mode_full else 'diff'}"
+    # diff stats pair with rectangle updates: only the changed area is redithered
+    use = f"paletteuse=dither={dither}" + ("" if stats_mode_full else ":diff_mode=rectangle")
+    return f"[{source}]split[a][b];[a]{gen}[p];[b][p]{use}[out]"
+
+def _gif_encode_args() -> List[str]:
+    """Output options shared by every GIF encode."""
+    return ["-loop", "0", "-f", "gif"]
+
+def _run_gif_encode(cmd: List[str], output_gif: str, stdin=None):
+    """_run_webp_encode for GIF."""
+    if output_gif == "-":
+        return _run(cmd + ["pipe:1"], check=True, stdin=stdin).stdout
+    _run(cmd + [output_gif], check=True, stdin=stdin)
+    return output_gif
+
+def _write_output(data: bytes, output: str):
+    """Return data for output "-", otherwise write it to output and return the path."""
+    if output == "-":
+        return data
+    with open(output, "wb") as f:
+        f.write(data)
+    return output
+
+def _parse_gif(data: bytes):
+    """
+    Split a GIF into (logical screen descriptor, global color table, blocks),
+    where blocks is [(kind, raw bytes)] for each extension (kind is its label)
+    and image (kind 0x2C) up to the trailer.
+    """
+    if data[:6] not in (b"GIF87a", b"GIF89a") or len(data) < 13:
+        raise ValueError("Not a GIF file")
+    screen = data[6:13]
+    pos = 13
+    gct = b""
+    if screen[4] & 0x80:
+        gct = data[pos:pos + (3 << ((screen[4] & 7) + 1))]
+        pos += len(gct)
+
+    def skip_sub_blocks(pos: int) -> int:
+        while True:
+            size = data[pos]
+            pos += 1 + size
+            if size == 0:
+                return pos
+
+    blocks = []
+    try:
+        while data[pos] != 0x3B:
+            start, kind = pos, data[pos]
+            if kind == 0x21:
+                kind = data[pos + 1]
+                pos = skip_sub_blocks(pos + 2)
+            elif kind == 0x2C:
+                packed = data[pos + 9]
+                pos += 10
+                if packed & 0x80:
+                    pos += 3 << ((packed & 7) + 1)
+                pos = skip_sub_blocks(pos + 1)  # after the LZW minimum code size
+            else:
+                raise ValueError(f"Unexpected GIF block 0x{kind:02x}")
+            blocks.append((kind, data[start:pos]))
+    except IndexError:
+        raise ValueError("Truncated GIF file")
+    return screen, gct, blocks
+
+def join_animated_gif(parts: List[bytes]) -> bytes:
+    """
+    Concatenate animated GIFs with the same canvas into one animation. A later
+    part's global palette becomes a local color table where it differs.
+    """
+    screen, gct, blocks = _parse_gif(parts[0])
+    out = bytearray(parts[0][:6] + screen + gct)
+    for i, part in enumerate(parts):
+        part_screen, part_gct, part_blocks = (screen, gct, blocks) if i == 0 else _parse_gif(part)
+        for kind, block in part_blocks:
+            if i and kind not in (0xF9, 0x2C):
+                continue  # application and comment extensions: the first part's are kept
+            if kind == 0x2C and part_gct != gct and not block[9] & 0x80:
+                packed = (block[9] & 0x60) | 0x80 | (part_screen[4] & 7)
+                block = block[:9] + bytes([packed]) + part_gct + block[10:]
+            out += block
+    out += b"\x3b"
+    return bytes(out)
+
+def gif_frame_count(data: bytes) -> int:
+    """Number of frames (image blocks) in a GIF file."""
+    return sum(1 for kind, _ in _parse_gif(data)[2] if kind == 0x2C)
+
+def _scene_plan(
+    cuts: List[float],
+    fps: int,
+    start_time: Optional[str],
+    end_time: Optional[str],
+    media_info: MediaInfo,
+):
+    """
+    Snap scene cuts (seconds from start_time) to the output frame grid and
+    return [(start_time, end_time, frames)] per scene like _chunk_plan; the
+    last scene runs to end_time, or to the end of the input when unknown.
+    """
+    out_fps, start_s, end_s = _frame_grid(fps, start_time, end_time, media_info)
+    total = int((end_s - start_s) * out_fps) if end_s else None
+    bounds = [0]
+    for cut in cuts:
+        frame = int(round(cut * out_fps))
+        if frame > bounds[-1] and (total is None or frame < total):
+            bounds.append(frame)
+    bounds.append(total)
+    return _frame_windows(bounds, out_fps, start_s, end_s)
+
+def convert_video_to_gif(
+    input_video: str,
+    output_gif: str,
+    max_size: int = 300,
+    fps: int = 20,
+    colors: int = 256,
+    dither: str = "sierra2_4a",
+    stats_mode_full: bool = True,
+    crop_angle: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    quality_boost: bool = False,
+    input_headers: Optional[dict] = None,
+    media_info: Optional[MediaInfo] = None,
+    stdin=None,
+    per_scene: bool = False,
+    workers: Optional[int] = None,
+):
+    """
+    Encode input_video to a GIF with the preset's palette fields and the same front
+    end as convert_video_to_webp. per_scene gives each scene its own palette (not
+    for a piped input, which cannot be read twice).
+    """
+    _require_cmd("ffmpeg")
+    if media_info is None:
+        media_info = probe_media(input_video, input_headers) if stdin is None else MediaInfo()
+    fps = min(fps, GIF_MAX_FPS)
+
+    def encode(output: str, start: Optional[str], end: Optional[str], frames: Optional[int] = None):
+        cmd = _video_gif_cmd(
+            input_video, media_info, max_size, fps, colors, dither, stats_mode_full,
+            crop_angle, start, end, quality_boost, input_headers, frames,
+        )
+        with span("encode", start=start, end=end, colors=colors):
+            return _run_gif_encode(cmd, output, stdin=stdin)
+
+    plan = None
+    if per_scene and stdin is not None:
+        print("GIF palettes: a piped input cannot be scanned for scenes; using one palette")
+    elif per_scene:
+        cuts = detect_scene_cuts(input_video, start_time, end_time, input_headers)
+        plan = _scene_plan(cuts, fps, start_time, end_time, media_info)
+        print(f"GIF palettes: {len(plan)} scene(s)")
+    if not plan or len(plan) == 1:
+        return encode(output_gif, start_time, end_time)
+
+    workers = min(len(plan), workers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = [f.result() for f in [_job_submit(pool, encode, "-", *scene) for scene in plan]]
+    return _write_output(join_animated_gif(parts), output_gif)
+
+def _video_gif_cmd(
+    input_video: str,
+    media_info: MediaInfo,
+    max_size: int,
+    fps: int,
+    colors: int,
+    dither: str,
+    stats_mode_full: bool,
+    crop_angle: Optional[str],
+    start_time: Optional[str],
+    end_time: Optional[str],
+    quality_boost: bool,
+    input_headers: Optional[dict],
+    frames: Optional[int] = None,
+) -> List[str]:
+    """The convert_video_to_gif ffmpeg command, without the output."""
+    chain = ",".join(_video_filters(media_info, max_size, fps, crop_angle, quality_boost))
+    graph = f"[0:v]{chain}[v];" + _gif_palette_graph("v", colors, dither, stats_mode_full)
+    cmd = _video_input_args(input_video, start_time, end_time, input_headers)
+    cmd.extend(["-filter_complex", graph, "-map", "[out]"])
+    if frames:
+        cmd.extend(["-frames:v", str(frames)])
+    cmd.extend(_gif_encode_args())
+    return cmd
+
+def build_slideshow_gif(
+    images: List[str],
+    output_gif: str,
+    max_size: int = 300,
+    fps: int = 30,
+    colors: int = 256,
+    dither: str = "sierra2_4a",
+    stats_mode_full: bool = True,
+    seconds_per_image: float = 2.0,
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    quality_boost: bool = False,
+    per_scene: bool = False,
+):
+    """
+    build_slideshow_webp with GIF output; per_scene gives every image its own palette.
+    """
+    if not images:
+        raise ValueError("No images provided for slideshow")
+    _require_cmd("ffmpeg")
+    fps = min(fps, GIF_MAX_FPS)
+
+    def encode(output: str, images: List[str], start_s: Optional[float], end_s: Optional[float]):
+        cmd = ["ffmpeg", "-y"]
+        for img in images:
+            cmd.extend(["-i", img])
+        graph = _slideshow_graph(len(images), max_size, fps, seconds_per_image, start_s, end_s, quality_boost, label="v")
+        graph += ";" + _gif_palette_graph("v", colors, dither, stats_mode_full)
+        cmd.extend(["-filter_complex", graph, "-map", "[out]"])
+        cmd.extend(_gif_encode_args())
+        return _run_gif_encode(cmd, output)
+
+    print(f"Encoding {len(images)} images to GIF slideshow")
+    with span("slideshow", images=len(images)):
+        if not per_scene or len(images) == 1:
+            return encode(output_gif, images, start_s, end_s)
+        # The part of the trim window each image covers, relative to that image
+        start, end = start_s or 0.0, len(images) * seconds_per_image if end_s is None else end_s
+        scenes = []
+        for i, img in enumerate(images):
+            offset = i * seconds_per_image
+            if offset + seconds_per_image <= start or offset >= end:
+                continue
+            scenes.append((
+                [img],
+                start - offset if start > offset else None,
+                end - offset if end < offset + seconds_per_image else None,
+            ))
+        parts = [encode("-", *scene) for scene in scenes]
+        return _write_output(join_animated_gif(parts), output_gif)
+
+def _run_seekable_encode(cmd: List[str], output: str, suffix: str, stdin=None):
+    """
+    _run_webp_encode for muxers that seek back to finish the file (MP4, AVIF):
+    output "-" is encoded to a temporary file and returned as bytes.
+    """
+    if output != "-":
+        _run(cmd + [output], check=True, stdin=stdin)
+        return output
+    fd, path = tempfile.mkstemp(prefix="gifpy_", suffix=suffix)
+    os.close(fd)
+    try:
+        _run(cmd + [path], check=True, stdin=stdin)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+def _budget_rate(target_bytes: Optional[int], seconds: Optional[float]) -> Optional[int]:
+    """Peak bitrate (bit/s) that keeps a rate-capped encode of `seconds` under target_bytes."""
+    if not target_bytes or not seconds:
+        return None
+    # A one-second VBV buffer can overshoot the average by a second's worth of bits
+    return max(1000, int(target_bytes * 8 * 0.95 / (seconds + 1)))
+
+class Encoder(abc.ABC):
+    """
+    An output format behind the shared front end (trim, filters, slideshow graph),
+    configured by a build_preset() dict.
+    """
+    name = None
+    ext = None
+    mime = None
+
+    def __init__(self, workers: Optional[int] = None, decimate: bool = False, per_scene: bool = False):
+        self.workers = workers
+        self.decimate = decimate
+        self.per_scene = per_scene
+
+    @abc.abstractmethod
+    def encode_video(self, input_video: str, output: str, preset: dict, target_bytes: Optional[int] = None, **front):
+        pass
+
+    @abc.abstractmethod
+    def encode_slideshow(self, images: List[str], output: str, preset: dict, seconds_per_image: float = 2.0,
+                         start_s: Optional[float] = None, end_s: Optional[float] = None, target_bytes: Optional[int] = None):
+        pass
+
+class VideoCodecEncoder(Encoder):
+    """
+    A video codec run as one ffmpeg encode with the subclass's codec_args().
+    With target_bytes the bitrate is capped to fit the clip into the budget.
+    """
+
+    @abc.abstractmethod
+    def codec_args(self, quality: int, max_rate: Optional[int] = None) -> List[str]:
+        """Output options for a quality on the preset's 0-100 webp_quality scale."""
+
+    def encode_video(
+        self,
+        input_video: str,
+        output: str,
+        preset: dict,
+        target_bytes: Optional[int] = None,
+        crop_angle: Optional[str] = None,
+        start_time: Optional[str] = None,
+        end_time: Optional[str] = None,
+        input_headers: Optional[dict] = None,
+        media_info: Optional[MediaInfo] = None,
+        stdin=None,
+    ):
+        _require_cmd("ffmpeg")
+        if media_info is None:
+            media_info = probe_media(input_video, input_headers) if stdin is None else MediaInfo()
+        decimate = self.decimate or preset.get('decimate', False)
+        chain = ",".join(_video_filters(
+            media_info, preset['max_size'], preset['fps'], crop_angle,
+            preset.get('quality_boost', False), decimate, even=True,
+        ))
+        cmd = _video_input_args(input_video, start_time, end_time, input_headers)
+        cmd.extend(["-vf", chain, "-an"])
+        if decimate:
+            cmd.extend(["-fps_mode", "vfr"])
+        with span("encode", start=start_time, end=end_time, format=self.name):
+            return self._run_capped(
+                lambda max_rate: cmd + self.codec_args(preset['webp_quality'], max_rate),
+                output, target_bytes, _clip_seconds(start_time, end_time, media_info), stdin,
+            )
+
+    def encode_slideshow(
+        self,
+        images: List[str],
+        output: str,
+        preset: dict,
+        seconds_per_image: float = 2.0,
+        start_s: Optional[float] = None,
+        end_s: Optional[float] = None,
+        target_bytes: Optional[int] = None,
+    ):
+        if not images:
+            raise ValueError("No images provided for slideshow")
+        _require_cmd("ffmpeg")
+        decimate = self.decimate or preset.get('decimate', False)
+        cmd = ["ffmpeg", "-y"]
+        for img in images:
+            cmd.extend(["-i", img])
+        graph = _slideshow_graph(
+            len(images), preset['max_size'], preset['fps'], seconds_per_image, start_s, end_s,
+            preset.get('quality_boost', False), decimate, even=True,
+        )
+        cmd.extend(["-filter_complex", graph, "-map", "[out]"])
+        if decimate:
+            cmd.extend(["-fps_mode", "vfr"])
+        print(f"Encoding {len(images)} images to {self.name.upper()} slideshow")
+        with span("slideshow", images=len(images)):
+            return self._run_capped(
+                lambda max_rate: cmd + self.codec_args(preset['webp_quality'], max_rate),
+                output, target_bytes, _slideshow_seconds(len(images), seconds_per_image, start_s, end_s),
+            )
+
+    def _run_capped(self, cmd_for: Callable, output: str, target_bytes: Optional[int], seconds: Optional[float], stdin=None):
+        """
+        Run cmd_for(max_rate) at the rate fitting target_bytes, encoding once more at a
+        lower rate if the result overshoots (not for a pipe).
+        """
+        max_rate = _budget_rate(target_bytes, seconds)
+        if not max_rate:
+            return _run_seekable_encode(cmd_for(None), output, self.ext, stdin=stdin)
+        data = _run_seekable_encode(cmd_for(max_rate), "-", self.ext, stdin=stdin)
+        if len(data) > target_bytes and stdin is None:
+            max_rate = max(1000, int(max_rate * target_bytes / len(data) * 0.9))
+            print(f"{self.name}: {len(data) / 1024:.0f} KiB is over the budget, encoding again at {max_rate / 1000:.0f} kbit/s")
+            retry = _run_seekable_encode(cmd_for(max_rate), "-", self.ext)
+            data = min(data, retry, key=len)
+        if output == "-":
+            return data
+        with open(output, "wb") as f:
+            f.write(data)
+        return output
+
+class WebPEncoder(Encoder):
+    """Animated WebP (libwebp): parallel chunks, or the budget ladder with target_bytes (slideshows too)."""
+    name, ext, mime = "webp", ".webp", "image/webp"
+
+    def encode_video(self, input_video: str, output: str, preset: dict, target_bytes: Optional[int] = None, stdin=None, **front):
+        args = dict(
+            max_size=preset['max_size'],
+            fps=preset['fps'],
+            webp_quality=preset['webp_quality'],
+            quality_boost=preset.get('quality_boost', False),
+            decimate=self.decimate or preset.get('decimate', False),
+            **front,
+        )
+        if target_bytes:
+            return convert_video_to_webp_budget(input_video, output, target_bytes=target_bytes, **args)
+        if stdin is None:
+            return convert_video_to_webp_parallel(input_video, output, workers=self.workers, **args)
+        return convert_video_to_webp(input_video, output, stdin=stdin, **args)
+
+    def encode_slideshow(self, images: List[str], output: str, preset: dict, seconds_per_image: float = 2.0,
+                         start_s: Optional[float] = None, end_s: Optional[float] = None, target_bytes: Optional[int] = None):
+        args = dict(
+            max_size=preset['max_size'],
+            fps=preset['fps'],
+            webp_quality=preset['webp_quality'],
+            seconds_per_image=seconds_per_image,
+            start_s=start_s,
+            end_s=end_s,
+            quality_boost=preset.get('quality_boost', False),
+            decimate=self.decimate or preset.get('decimate', False),
+        )
+        if target_bytes:
+            return build_slideshow_webp_budget(images, output, target_bytes=target_bytes, **args)
+        return build_slideshow_webp(images, output, **args)
+
+class GifEncoder(Encoder):
+    """GIF with the preset's palette settings (see convert_video_to_gif). No size budget or decimation."""
+    name, ext, mime = "gif", ".gif", "image/gif"
+
+    def _palette(self, preset: dict, target_bytes: Optional[int]) -> dict:
+        if target_bytes:
+            print("Warning: the size budget does not apply to GIF output; encoding at the preset")
+        if self.decimate:
+            print("Warning: decimate does not apply to GIF output")
+        return dict(
+            max_size=preset['max_size'],
+            fps=preset['fps'],
+            colors=preset['colors'],
+            dither=preset['dither'],
+            stats_mode_full=preset['stats_mode_full'],
+            quality_boost=preset.get('quality_boost', False),
+            per_scene=self.per_scene,
+        )
+
+    def encode_video(self, input_video: str, output: str, preset: dict, target_bytes: Optional[int] = None, **front):
+        return convert_video_to_gif(input_video, output, workers=self.workers, **self._palette(preset, target_bytes), **front)
+
+    def encode_slideshow(self, images: List[str], output: str, preset: dict, seconds_per_image: float = 2.0,
+                         start_s: Optional[float] = None, end_s: Optional[float] = None, target_bytes: Optional[int] = None):
+        return build_slideshow_gif(
+            images, output, seconds_per_image=seconds_per_image, start_s=start_s, end_s=end_s,
+            **self._palette(preset, target_bytes),
+        )
+
+class Mp4Encoder(VideoCodecEncoder):
+    """
+    Muted H.264 MP4 (libx264 veryfast): a fraction of libwebp's encode time
+    and output size, and Discord plays short muted MP4s inline.
+    """
+    name, ext, mime = "mp4", ".mp4", "video/mp4"
+
+    def codec_args(self, quality: int, max_rate: Optional[int] = None) -> List[str]:
+        # webp_quality 90 -> CRF 22, 75 -> 28, 55 -> 36
+        args = ["-c:v", "libx264", "-preset", "veryfast", "-crf", str(round(18 + (100 - quality) * 0.4)), "-pix_fmt", "yuv420p"]
+        if max_rate:
+            args.extend(["-maxrate", str(max_rate), "-bufsize", str(max_rate)])
+        return args + ["-movflags", "+faststart", "-f", "mp4"]
+
+class AvifEncoder(VideoCodecEncoder):
+    """
+    Animated AVIF (libaom-av1 in realtime mode): the smallest output, at
+    about libwebp's encode time. With a bitrate it runs constrained quality.
+    """
+    name, ext, mime = "avif", ".avif", "image/avif"
+
+    def codec_args(self, quality: int, max_rate: Optional[int] = None) -> List[str]:
+        # webp_quality 90 -> CRF 26, 75 -> 35, 55 -> 47
+        return [
+            "-c:v", "libaom-av1", "-usage", "realtime", "-cpu-used", "8", "-row-mt", "1",
+            "-crf", str(round(20 + (100 - quality) * 0.6)), "-b:v", str(max_rate or 0),
+            "-pix_fmt", "yuv420p", "-loop", "0", "-f", "avif",
+        ]
+
+ENCODERS = {cls.name: cls for cls in (WebPEncoder, GifEncoder, Mp4Encoder, AvifEncoder)}
+# "auto" tries these fastest first (see AutoEncoder). GIF is never smaller
+# than the others, and WebP comes last: its budget ladder always returns
+# its smallest attempt.
+AUTO_FORMATS = ("mp4", "avif", "webp")
+
+class AutoEncoder(Encoder):
+    """
+    Picks the first of AUTO_FORMATS whose output fits target_bytes (the smallest if
+    none does, the fastest without a budget), skipping formats that fail to encode.
+    chosen is the encoder that produced the result.
+    """
+    name, ext, mime = "auto", None, None
+
+    def __init__(self, workers: Optional[int] = None, decimate: bool = False, per_scene: bool = False):
+        super().__init__(workers, decimate, per_scene)
+        self.chosen: Optional[Encoder] = None
+
+    def encode_video(self, input_video: str, output: str, preset: dict, target_bytes: Optional[int] = None, **front):
+        return self._first_fit(
+            lambda encoder: encoder.encode_video(input_video, "-", preset, target_bytes, **front),
+            output, target_bytes,
+        )
+
+    def encode_slideshow(self, images: List[str], output: str, preset: dict, seconds_per_image: float = 2.0,
+                         start_s: Optional[float] = None, end_s: Optional[float] = None, target_bytes: Optional[int] = None):
+        return self._first_fit(
+            lambda encoder: encoder.encode_slideshow(images, "-", preset, seconds_per_image, start_s, end_s, target_bytes),
+            output, target_bytes,
+        )
+
+    def _first_fit(self, encode: Callable, output: str, target_bytes: Optional[int]):
+        best = error = None
+        for name in AUTO_FORMATS:
+            encoder = ENCODERS[name](self.workers, self.decimate, self.per_scene)
+            try:
+                data = encode(encoder)
+            except subprocess.CalledProcessError as e:
+                # e.g. an ffmpeg build without the codec: another format may still fit
+                print(f"Auto format: {name} failed (exit {e.returncode}), trying the next format")
+                error = e
+                continue
+            if best is None or len(data) < len(best[1]):
+                best = (encoder, data)
+            if not target_bytes or len(data) <= target_bytes:
+                best = (encoder, data)
+                break
+            print(f"Auto format: {name} is {len(data) / 1024:.0f} KiB, over the {target_bytes / 1024:.0f} KiB budget")
+        if best is None:
+            raise error
+        # Nothing fits: the smallest attempt
+        encoder, data = best
+        self.chosen = encoder
+        print(f"Auto format: {encoder.name}")
+        if output == "-":
+            return data
+        output = os.path.splitext(output)[0] + encoder.ext
+        with open(output, "wb") as f:
+            f.write(data)
+        return output
+
+def get_encoder(name: str, **options) -> Encoder:
+    """The Encoder for an OUTPUT_FORMATS name; options go to its constructor."""
+    if name == "auto":
+        return AutoEncoder(**options)
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown output format: {name}")
+    return ENCODERS[name](**options)
+
+class Rendition:
+    """
+    One output of encode_renditions(): name, longest side, fps (None: the preset's)
+    and format. After the run result holds the output and metadata() describes it.
+    """
+
+    def __init__(self, name: str, max_size: int, fps: Optional[int] = None, output_format: str = "webp", output: str = "-"):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.name = name
+        self.max_size = max_size
+        self.fps = fps
+        self.output_format = output_format
+        self.output = output
+        self.result = None
+        self.width = 0
+        self.height = 0
+        self.seconds: Optional[float] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rendition":
+        """From NAME:SIZE[:FPS[:FORMAT]], e.g. "emoji:128:15" or "preview:720::mp4"."""
+        parts = spec.split(":")
+        if len(parts) < 2 or len(parts) > 4 or not parts[0]:
+            raise ValueError(f"Rendition must be NAME:SIZE[:FPS[:FORMAT]], got {spec!r}")
+        fps = parts[2] if len(parts) > 2 and parts[2] else None
+        output_format = parts[3] if len(parts) > 3 and parts[3] else "webp"
+        return cls(parts[0], int(parts[1]), int(fps) if fps else None, output_format)
+
+    def metadata(self) -> dict:
+        data = self.result
+        if data is not None and not isinstance(data, (bytes, bytearray)):
+            with open(data, "rb") as f:
+                data = f.read()
+        frames = None
+        if data:
+            if data[:4] == b"RIFF":
+                frames = webp_frame_count(data)
+            elif data[:3] == b"GIF":
+                frames = gif_frame_count(data)
+        meta = {
+            "name": self.name,
+            "format": self.output_format,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "bytes": len(data) if data is not None else None,
+            "frames": frames,
+            "seconds": self.seconds,
+        }
+        if self.output != "-":
+            meta["output"] = self.result
+        return meta
+
+    def __repr__(self):
+        return f"Rendition({self.name!r}, {self.max_size}, fps={self.fps}, format={self.output_format!r})"
+
+def _release_fifo(path: str):
+    """Open and close the write end of a FIFO so a reader blocked in open() gets EOF."""
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+    except OSError:
+        pass  # no reader waiting
+
+def encode_renditions(
+    renditions: List[Rendition],
+    preset: dict,
+    input_video: Optional[str] = None,
+    images: Optional[List[str]] = None,
+    crop_angle: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    input_headers: Optional[dict] = None,
+    media_info: Optional[MediaInfo] = None,
+    stdin=None,
+    seconds_per_image: float = 2.0,
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    decimate: bool = False,
+) -> List[Rendition]:
+    """
+    Several outputs of one clip from a single decode: one ffmpeg process splits the
+    filtered frames into a scaled branch per rendition, which its Encoder reads
+    from a FIFO (so no WebP size budget). Returns the renditions with results.
+    """
+    _require_cmd("ffmpeg")
+    if not hasattr(os, "mkfifo"):
+        raise RuntimeError("Rendition fan-out needs named pipes (os.mkfifo)")
+    if not renditions:
+        raise ValueError("No renditions requested")
+    largest = max(r.max_size for r in renditions)
+    top_fps = max(r.fps or preset['fps'] for r in renditions)
+    if images is not None:
+        cmd = ["ffmpeg", "-y"]
+        for img in images:
+            cmd.extend(["-i", img])
+        graph = _slideshow_graph(
+            len(images), largest, top_fps, seconds_per_image, start_s, end_s,
+            preset.get('quality_boost', False), label="src",
+        )
+        seconds = _slideshow_seconds(len(images), seconds_per_image, start_s, end_s)
+    else:
+        if media_info is None:
+            media_info = probe_media(input_video, input_headers) if stdin is None else MediaInfo()
+        if media_info.fps:
+            top_fps = min(Fraction(top_fps), media_info.fps)
+        chain = ",".join(_video_filters(media_info, largest, top_fps, crop_angle, preset.get('quality_boost', False)))
+        cmd = _video_input_args(input_video, start_time, end_time, input_headers)
+        graph = f"[0:v]{chain}[src]"
+        seconds = _clip_seconds(start_time, end_time, media_info)
+    for r in renditions:
+        r.fps = min(Fraction(r.fps or preset['fps']), Fraction(top_fps))
+    graph += f";[src]split={len(renditions)}" + "".join(f"[s{i}]" for i in range(len(renditions)))
+    for i, r in enumerate(renditions):
+        # The 4:2:0 video codecs need even dimensions; round in the branch so they are final here
+        even = r.output_format in ("mp4", "avif", "auto")
+        fps = f"fps={r.fps}," if r.fps != top_fps else ""
+        graph += f";[s{i}]{fps}{_scale_filter(r.max_size, even)}[o{i}]"
+    cmd.extend(["-filter_complex", graph])
+
+    print(f"Encoding {len(renditions)} renditions from one decode: " + ", ".join(
+        f"{r.name} {r.max_size}px {float(r.fps):g}fps {r.output_format}" for r in renditions))
+    with tempfile.TemporaryDirectory(prefix="gifpy_fanout_") as fifo_dir:
+        fifos = []
+        for i in range(len(renditions)):
+            path = os.path.join(fifo_dir, f"{i}.nut")
+            os.mkfifo(path)
+            fifos.append(path)
+            cmd.extend(["-map", f"[o{i}]", "-c:v", "rawvideo", "-f", "nut", path])
+
+        def decode() -> bytes:
+            try:
+                with span("decode", renditions=len(renditions)):
+                    return _run(cmd, check=True, stdin=stdin).stderr
+            finally:
+                # A decoder that failed before opening every FIFO would leave its readers waiting
+                for path in fifos:
+                    _release_fifo(path)
+
+        def encode(r: Rendition, path: str):
+            started = time.monotonic()
+            encoder = get_encoder(r.output_format, decimate=decimate)
+            # Crop, denoise and trim are done; the encoder only sees the branch
+            branch_preset = dict(preset, max_size=r.max_size, fps=r.fps, quality_boost=False)
+            with open(path, "rb") as fifo:
+                r.result = encoder.encode_video(
+                    "pipe:0", r.output, branch_preset, stdin=fifo,
+                    media_info=MediaInfo(fps=Fraction(r.fps), duration=seconds or 0.0),
+                )
+            r.seconds = round(time.monotonic() - started, 3)
+            if getattr(encoder, "chosen", None):
+                r.output_format = encoder.chosen.name
+
+        with ThreadPoolExecutor(max_workers=len(renditions) + 1) as pool:
+            decoding = _job_submit(pool, decode)
+            encodes = [_job_submit(pool, encode, r, path) for r, path in zip(renditions, fifos)]
+            wait([decoding, *encodes])
+            stderr = decoding.result()
+            for future in encodes:
+                future.result()
+
+    # The decoder logs every output stream with its final size, as each one starts
+    for index, width, height in re.findall(
+        r"Output #(\d+), nut.*?Stream #\d+:\d+: Video: [^\n]*?, (\d+)x(\d+)", stderr.decode(errors="ignore"), re.S
+    ):
+        renditions[int(index)].width, renditions[int(index)].height = int(width), int(height)
+    for r in renditions:
+        r.fps = float(r.fps)
+    return renditions
+
+def extract_post_id(url: str) -> str:
+    parsed = urlparse(url)
+    path = parsed.path
+    parts = [p for p in path.split('/') if p]
+    # /status/<id>/video/<n>: the id follows "status", not the trailing index
+    if "status" in parts:
+        i = parts.index("status")
+        if i + 1 < len(parts) and parts[i + 1].isdigit():
+            return parts[i + 1]
+    for part in reversed(parts):
+        if part.isdigit():
+            return part
+    m = re.search(r"(\d+)", parsed.geturl())
+    return m.group(1) if m else "post"
+
+def is_image_only_post(info) -> bool:
+    """Heuristic to detect if post has only images and no video. Accepts a PostInfo or raw info dict."""
+    if isinstance(info, PostInfo):
+        info = info.info
+    if not isinstance(info, dict):
+        return False
+    entries = info.get('entries', [info]) if 'entries' in info else [info]
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        if entry.get('duration') or entry.get('formats'):
+            return False
+        media = entry.get('media') or []
+        for m in media:
+            if m.get('type') == 'video':
+                return False
+    return True
+
+OUTPUT_FORMATS = tuple(ENCODERS) + ("auto",)
+PRESET_NAMES = ("fast", "medium", "high", "auto")
+
+def build_preset(name: str):
+    name = name.lower()
+    if name == "fast":
+        return dict(fps=12, colors=128, dither="bayer:bayer_scale=3", stats_mode_full=False, quality_boost=False, webp_quality=75, webp_lossless=False, max_size=300)
+    if name == "medium":
+        return dict(fps=16, colors=200, dither="sierra2_4a", stats_mode_full=True, quality_boost=False, webp_quality=80, webp_lossless=False, max_size=300)
+    return dict(fps=30, colors=256, dither="sierra2_4a", stats_mode_full=True, quality_boost=False, webp_quality=90, webp_lossless=False, max_size=400)
+
+class ContentStats:
+    """
+    What analyze_content() measured on a downscaled sample: scene cuts per
+    second, mean absolute frame difference (0-255 luma, the motion estimate)
+    and the share of frames that are practically unchanged from the previous one.
+    """
+
+    def __init__(self, seconds: float = 0.0, frames: int = 0, scene_rate: float = 0.0, motion: float = 0.0, static_ratio: float = 0.0):
+        self.seconds = seconds
+        self.frames = frames
+        self.scene_rate = scene_rate
+        self.motion = motion
+        self.static_ratio = static_ratio
+
+    def as_dict(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 2),
+            "frames": self.frames,
+            "scene_rate": round(self.scene_rate, 3),
+            "motion": round(self.motion, 3),
+            "static_ratio": round(self.static_ratio, 3),
+        }
+
+    def __repr__(self):
+        return f"ContentStats({self.as_dict()})"
+
+ANALYZE_FPS = 10
+ANALYZE_WIDTH = 160
+SCENE_THRESHOLD = 0.3
+STATIC_DIFF = 0.5  # mean luma difference below which a frame counts as unchanged
+
+def analyze_content(
+    input_video: str,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    input_headers: Optional[dict] = None,
+    sample_seconds: float = 6.0,
+) -> ContentStats:
+    """
+    One cheap ffmpeg pass over at most sample_seconds of the trim window,
+    decimated to ANALYZE_FPS and scaled to ANALYZE_WIDTH gray: the scene score
+    counts cuts, and tblend's frame difference gives motion and static frames.
+    """
+    _require_cmd("ffmpeg")
+    start_s = parse_time(start_time) if start_time else 0.0
+    window = parse_time(end_time) - start_s if end_time else None
+    duration = min(window, sample_seconds) if window else sample_seconds
+    cmd = _video_input_args(input_video, start_time, str(start_s + duration), input_headers)
+    cmd[1:1] = ["-hide_banner", "-nostats"]
+    cmd.extend([
+        "-an",
+        "-vf", (
+            f"fps={ANALYZE_FPS},scale={ANALYZE_WIDTH}:-2,format=gray,"
+            f"select='gte(scene\\,0)',tblend=all_mode=difference,signalstats,metadata=print:file=-"
+        ),
+        "-f", "null", "-",
+    ])
+    with span("analyze"):
+        output = _run(cmd, check=True).stdout.decode(errors="ignore")
+    scores = [float(v) for v in re.findall(r"lavfi\.scene_score=([\d.]+)", output)]
+    diffs = [float(v) for v in re.findall(r"lavfi\.signalstats\.YAVG=([\d.]+)", output)]
+    frames = len(diffs)
+    if not frames:
+        return ContentStats(seconds=duration)
+    seconds = frames / ANALYZE_FPS
+    return ContentStats(
+        seconds=seconds,
+        frames=frames,
+        scene_rate=sum(1 for s in scores if s > SCENE_THRESHOLD) / seconds,
+        motion=sum(diffs) / frames,
+        static_ratio=sum(1 for d in diffs if d < STATIC_DIFF) / frames,
+    )
+
+def detect_scene_cuts(
+    input_video: str,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    input_headers: Optional[dict] = None,
+    threshold: Optional[float] = None,
+    min_gap: Optional[float] = None,
+    max_scenes: Optional[int] = None,
+) -> List[float]:
+    """
+    Scene cuts in the trim window, in seconds from its start, from one low-resolution
+    pass; cuts within min_gap are dropped and the strongest max_scenes - 1 kept.
+    """
+    _require_cmd("ffmpeg")
+    threshold = SCENE_THRESHOLD if threshold is None else threshold
+    min_gap = GIF_MIN_SCENE_SECONDS if min_gap is None else min_gap
+    max_scenes = GIF_MAX_SCENES if max_scenes is None else max_scenes
+    cmd = _video_input_args(input_video, start_time, end_time, input_headers)
+    cmd[1:1] = ["-hide_banner", "-nostats"]
+    cmd.extend([
+        "-an",
+        "-vf", f"scale={ANALYZE_WIDTH}:-2,format=gray,select='gt(scene\\,{threshold})',metadata=print:file=-",
+        "-f", "null", "-",
+    ])
+    with span("analyze", what="scenes"):
+        output = _run(cmd, check=True).stdout.decode(errors="ignore")
+    found = [
+        (float(t), float(score))
+        for t, score in re.findall(r"pts_time:([\d.]+)\s+lavfi\.scene_score=([\d.]+)", output)
+    ]
+    cuts = []
+    for t, score in found:
+        if t < min_gap:
+            continue
+        if cuts and t - cuts[-1][0] < min_gap:
+            if score > cuts[-1][1]:
+                cuts[-1] = (t, score)
+            continue
+        cuts.append((t, score))
+    strongest = sorted(cuts, key=lambda c: c[1], reverse=True)[:max(0, max_scenes - 1)]
+    return sorted(t for t, _ in strongest)
+
+def auto_preset(stats: ContentStats, max_fps: int = 60) -> dict:
+    """
+    Pick fps, size, quality and denoise for the measured content, starting from
+    "high": static input gets a low frame rate and a larger output, high motion
+    fewer bytes per frame. The reason is recorded under "auto".
+    """
+    preset = build_preset("high")
+    if stats.static_ratio >= 0.8:
+        kind, fps, max_size, quality, denoise = "static", 10, 480, 70, False
+    elif stats.motion < 2 and stats.scene_rate < 0.2:
+        kind, fps, max_size, quality, denoise = "low_motion", 20, 400, 70, False
+    elif stats.motion < 8 and stats.scene_rate < 0.5:
+        kind, fps, max_size, quality, denoise = "moderate_motion", 30, 400, 65, True
+    else:
+        kind, fps, max_size, quality, denoise = "high_motion", 30, 360, 55, True
+    preset.update(
+        fps=min(fps, max_fps),
+        max_size=max_size,
+        webp_quality=quality,
+        quality_boost=denoise,
+        # Any held frames are worth dropping when a good share is static
+        decimate=stats.static_ratio >= 0.2,
+        auto=dict(kind=kind, **stats.as_dict()),
+    )
+    return preset
+
+def parse_time(time_str: str) -> int:
     """Parse MM:SS time string into total seconds."""
     try:
         minutes, seconds = map(int, time_str.split(':'))
@@ -417,150 +2575,1683 @@ def parse_time(time_str: str) -> int:
     except:
         raise ValueError(f"Invalid time format: {time_str}. Expected MM:SS")
 
-def main():
-    parser = argparse.ArgumentParser(description='Convert X/Twitter videos to WebP format')
-    parser.add_argument('url', help='X/Twitter post URL')
-    parser.add_argument('start_time', help='Start time in MM:SS format (00:00 for no trim)')
-    parser.add_argument('end_time', help='End time in MM:SS format (00:00 for no trim)')
-    parser.add_argument('output', help='Output file path for the WebP image')
+def _video_index(url: str) -> Optional[int]:
+    """Return N from a /video/N URL, or None."""
+    m = re.search(r"/video/(\d+)", url)
+    return int(m.group(1)) if m else None
 
-    args = parser.parse_args()
+class ResultCache:
+    """
+    On-disk cache of finished outputs keyed by post, video, trim window and preset.
+    Writes are atomic, and the least recently hit entries go first over max_bytes.
+    """
 
-    # Validate time format
-    if args.start_time != "00:00":
-        parse_time(args.start_time)
-    if args.end_time != "00:00":
-        parse_time(args.end_time)
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
 
-    # Set default quality preset
-    preset = build_preset("high")
-    preset['fps'] = 60  # Override default 30fps
+    @staticmethod
+    def make_key(post_id: str, video_index: Optional[int], start_s: Optional[int], end_s: Optional[int], preset: dict) -> str:
+        raw = json.dumps([post_id, video_index, start_s, end_s, preset], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-    print(f"Processing: {args.url}")
-    print(f"Time range: {args.start_time} to {args.end_time}")
-    print(f"Quality: high, FPS: {preset['fps']}")
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key + ext)
 
-    try:
-        post_id = extract_post_id(args.url)
-        output_dir = "output"
-        os.makedirs(output_dir, exist_ok=True)
-        out_name = args.output
-
-        # Analyze URL
-        ydl_opts = {'quiet': True, 'noprogress': True, 'skip_download': True}
-        info = None
+    def get(self, key: str, ext: str = ".webp") -> Optional[str]:
+        path = self._path(key, ext)
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(args.url, download=False)
-        except Exception as e:
-            print(f"Failed to analyze URL: {e}")
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, src_path: str, ext: str = ".webp") -> str:
+        with open(src_path, "rb") as src:
+            return self._write(key, ext, lambda out: shutil.copyfileobj(src, out))
+
+    def put_bytes(self, key: str, data: bytes, ext: str = ".webp") -> str:
+        return self._write(key, ext, lambda out: out.write(data))
+
+    def _write(self, key: str, ext: str, write: Callable) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                write(out)
+            final = self._path(key, ext)
+            os.replace(tmp, final)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
             raise
+        self._evict()
+        return final
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+_RESULT_CACHE = ResultCache(
+    os.path.join(CACHE_DIR, "results"),
+    max_bytes=int(os.environ.get("GIFPY_RESULT_CACHE_MB", "512")) * 1024 * 1024,
+)
+
+class SourceCache:
+    """
+    Shared cache of downloaded source media per post and entry, so other trims and
+    presets of a recent post skip the network. Entries expire after ttl, the oldest
+    go over max_bytes, and flock()ed key files protect entries in use.
+    """
+
+    def __init__(self, directory: str, ttl: float = 15 * 60, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._thread_locks = {}
+        self._thread_locks_guard = threading.Lock()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def has(self, key: str) -> bool:
+        """True if key has an unexpired entry (it may still expire before open())."""
+        return self._is_fresh(key)
+
+    def _is_fresh(self, key: str) -> bool:
+        try:
+            return time.time() - os.stat(self._entry_dir(key)).st_mtime < self.ttl
+        except OSError:
+            return False
+
+    def _list(self, key: str) -> List[str]:
+        d = self._entry_dir(key)
+        return [os.path.join(d, n) for n in sorted(os.listdir(d))]
+
+    @contextmanager
+    def _locked(self, key: str, exclusive: bool, blocking: bool = True):
+        """Hold the key's lock; yields False instead of blocking when blocking=False and it is busy."""
+        if fcntl is None:
+            with self._thread_locks_guard:
+                lock = self._thread_locks.setdefault(key, threading.Lock())
+            acquired = lock.acquire(blocking)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    lock.release()
+            return
+
+        path = os.path.join(self.directory, key + ".lock")
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(fd, op if blocking else op | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                yield False
+                return
+            # The lock file may have been removed by eviction while we waited
+            try:
+                same = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                same = False
+            if same:
+                break
+            os.close(fd)
+        try:
+            yield True
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def open(self, key: str, loader: Callable[[str], List[str]]):
+        """
+        Yield the cached file paths for key, calling loader(dest_dir) to fill the
+        entry on a miss. The files stay valid until the with-block exits.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        loaded = False
+        while True:
+            with self._locked(key, exclusive=False):
+                if self._is_fresh(key):
+                    if not loaded:
+                        print(f"Source cache hit: {key}")
+                    yield self._list(key)
+                    return
+            with self._locked(key, exclusive=True):
+                if not self._is_fresh(key):
+                    self._load(key, loader)
+                    loaded = True
+            # Loop back to read the entry under a shared lock
+
+    def _load(self, key: str, loader: Callable[[str], List[str]]):
+        staging = tempfile.mkdtemp(prefix=f".{key}.", dir=self.directory)
+        try:
+            paths = loader(staging)
+            if not paths:
+                raise ValueError("Nothing was downloaded.")
+            # Drop anything the loader left behind that is not a result (e.g. .part files)
+            keep = {os.path.abspath(p) for p in paths}
+            for name in os.listdir(staging):
+                full = os.path.join(staging, name)
+                if os.path.abspath(full) not in keep:
+                    os.remove(full)
+            os.utime(staging)
+            final = self._entry_dir(key)
+            if os.path.isdir(final):
+                shutil.rmtree(final)
+            os.replace(staging, final)
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+        self._evict(exclude=key)
+
+    def _evict(self, exclude: Optional[str] = None):
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            full = os.path.join(self.directory, name)
+            if name.startswith(".") or name.endswith(".lock") or not os.path.isdir(full):
+                continue
+            size = 0
+            for f in os.listdir(full):
+                try:
+                    size += os.path.getsize(os.path.join(full, f))
+                except OSError:
+                    pass
+            try:
+                mtime = os.stat(full).st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, size, name))
+            total += size
+        entries.sort()
+        for mtime, size, name in entries:
+            expired = now - mtime >= self.ttl
+            if name == exclude or (not expired and total <= self.max_bytes):
+                continue
+            with self._locked(name, exclusive=True, blocking=False) as got:
+                if not got:
+                    continue
+                shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+                try:
+                    os.remove(os.path.join(self.directory, name + ".lock"))
+                except OSError:
+                    pass
+            total -= size
+
+_SOURCE_CACHE = SourceCache(
+    os.path.join(CACHE_DIR, "sources"),
+    ttl=float(os.environ.get("GIFPY_SOURCE_TTL", str(15 * 60))),
+    max_bytes=int(os.environ.get("GIFPY_SOURCE_CACHE_MB", "1024")) * 1024 * 1024,
+)
+
+@contextmanager
+def _source_files(source_cache: Optional[SourceCache], key: str, loader: Callable[[str], List[str]], work_dir: str):
+    """Yield source files for key, from source_cache when given, else freshly downloaded into work_dir."""
+    if source_cache is not None:
+        with source_cache.open(key, loader) as paths:
+            yield paths
+        return
+    with tempfile.TemporaryDirectory(prefix=f"{key}_", dir=work_dir) as tmp_dir:
+        yield loader(tmp_dir)
+
+REMOTE_PROTOCOLS = {"http", "https", "m3u8", "m3u8_native"}
+DEFAULT_CLIP_SECONDS = 8
+SLIDESHOW_SECONDS_PER_IMAGE = 2.0
+# Default gallery frame rate (capped at the preset's): stills only move while they zoom
+SLIDESHOW_FPS = 24
+
+def _pick_entry(post: PostInfo, index: int) -> Optional[dict]:
+    """Return the 1-based entry of a post, falling back to the first one."""
+    entries = post.entries
+    if not entries:
+        return None
+    if 1 <= index <= len(entries):
+        return entries[index - 1]
+    return entries[0]
+
+def _remote_window_input(
+    entry: Optional[dict],
+    start_s: Optional[int],
+    end_s: Optional[int],
+    fmt: Optional[dict] = None,
+    whole: bool = False,
+):
+    """
+    (url, http_headers, MediaInfo) to read the trim window straight from fmt (default:
+    the selected format) when it covers less than the whole video, or always with
+    whole=True; None means download the file instead.
+    """
+    if not isinstance(entry, dict):
+        return None
+    if fmt is None:
+        fmt = entry
+    if fmt is entry and entry.get('requested_formats'):
+        fmt = next((f for f in entry['requested_formats'] if f.get('vcodec') != 'none'), entry['requested_formats'][0])
+    media_url = fmt.get('url')
+    if not media_url or fmt.get('protocol', 'https') not in REMOTE_PROTOCOLS:
+        return None
+    duration = entry.get('duration')
+    if start_s is None and end_s is None:
+        window_end = DEFAULT_CLIP_SECONDS
+    else:
+        window_end = end_s
+    if not whole and (window_end is None or (duration and window_end >= duration)):
+        return None
+    headers = fmt.get('http_headers') or {}
+    media_info = MediaInfo.from_format(fmt, duration)
+    if not media_info.fps or not media_info.duration:
+        # Not in the metadata; ffprobe only reads the remote headers
+        media_info = probe_media(media_url, headers)
+    return media_url, headers, media_info
+
+def _open_ytdlp_stream(entry: dict, format_spec: Optional[str]) -> subprocess.Popen:
+    """
+    Start yt-dlp writing the entry's media to its stdout, for formats ffmpeg cannot
+    read by URL. Stop it with _reap(), which reports a failure with its stderr.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".info.json", delete=False) as info_file:
+        json.dump(yt_dlp.YoutubeDL.sanitize_info(entry), info_file)
+    cmd = [
+        sys.executable, "-m", "yt_dlp",
+        "--quiet", "--no-progress",
+        "--load-info-json", info_file.name,
+        "-f", format_spec or YDL_FORMAT,
+        "-o", "-",
+    ]
+    log = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log)
+    except OSError:
+        log.close()
+        os.remove(info_file.name)
+        raise
+    proc.info_file, proc.log = info_file.name, log
+    job = _CURRENT_JOB.get()
+    if job is not None:
+        job.attach(proc)
+    return proc
+
+def _trim_times(start_arg: str, end_arg: str, duration: Callable[[], float]):
+    """
+    Map the MM:SS arguments to ffmpeg start/end times (None = no bound).
+    With no trim at all, inputs longer than DEFAULT_CLIP_SECONDS are capped;
+    duration() is only called in that case.
+    """
+    start_time = None
+    end_time = None
+
+    if start_arg == "00:00" and end_arg == "00:00":
+        video_duration = duration()
+        print(f"Video duration: {video_duration} seconds")
+        if video_duration > DEFAULT_CLIP_SECONDS:
+            print(f"Video is longer than {DEFAULT_CLIP_SECONDS} seconds, limiting to {DEFAULT_CLIP_SECONDS} seconds")
+            end_time = f"00:{DEFAULT_CLIP_SECONDS:02d}"
+    elif start_arg != "00:00" and end_arg != "00:00":
+        start_time = start_arg
+        end_time = end_arg
+    elif start_arg != "00:00" and end_arg == "00:00":
+        start_time = start_arg
+    elif start_arg == "00:00" and end_arg != "00:00":
+        end_time = end_arg
+    return start_time, end_time
+
+class Conversion:
+    """
+    One convert_post() run, split where the network-bound work ends: prepare()
+    checks the caches and opens the source, render() encodes, close() cleans up.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        start_arg: str,
+        end_arg: str,
+        out_name: str,
+        work_dir: str = ".",
+        result_cache: Optional[ResultCache] = _RESULT_CACHE,
+        source_cache: Optional[SourceCache] = _SOURCE_CACHE,
+        ranged: bool = True,
+        target_bytes: Optional[int] = None,
+        encode_workers: Optional[int] = None,
+        preset: str = "high",
+        post_cache: Optional[PostInfoCache] = None,
+        image_fetcher=None,
+        trace: Optional[Trace] = None,
+        decimate: bool = False,
+        output_format: str = "webp",
+        per_scene: bool = False,
+        renditions: Optional[List[Rendition]] = None,
+        slideshow_fps: Optional[int] = None,
+    ):
+        self.encoder = get_encoder(output_format, workers=encode_workers, decimate=decimate, per_scene=per_scene)
+        self.url = url
+        self.start_arg = start_arg
+        self.end_arg = end_arg
+        self.out_name = out_name
+        self.work_dir = work_dir
+        self.result_cache = result_cache
+        self.source_cache = source_cache
+        self.ranged = ranged
+        self.target_bytes = target_bytes
+        self.encode_workers = encode_workers
+        self.preset_name = preset
+        self.post_cache = post_cache
+        self.image_fetcher = image_fetcher
+        self.trace = trace or Trace()
+        self.decimate = decimate
+        self.output_format = output_format
+        self.per_scene = per_scene
+        self.renditions = renditions
+        self.slideshow_fps = slideshow_fps
+        self.in_memory = out_name == "-"
+        self.result = None
+        self.cache_key = None
+        self.images: Optional[List[str]] = None
+        self.input_video: Optional[str] = None
+        self.input_headers = None
+        self.input_stream = None
+        self.media_info: Optional[MediaInfo] = None
+        self.start_time = None
+        self.end_time = None
+        self.crop_angle = None
+        self._stack = ExitStack()
+
+    def close(self):
+        self._stack.close()
+
+    @contextmanager
+    def _tracing(self):
+        token = _CURRENT_TRACE.set(self.trace)
+        try:
+            yield
+        finally:
+            _CURRENT_TRACE.reset(token)
+
+    def prepare(self):
+        with self._tracing():
+            self._prepare()
+
+    def _prepare(self):
+        url, start_arg, end_arg, out_name = self.url, self.start_arg, self.end_arg, self.out_name
+        in_memory, source_cache, stack = self.in_memory, self.source_cache, self._stack
+        # Validate time format
+        start_s = parse_time(start_arg) if start_arg != "00:00" else None
+        end_s = parse_time(end_arg) if end_arg != "00:00" else None
+
+        # Set quality preset ("auto" starts from high and is tuned once the input is known)
+        preset = build_preset(self.preset_name)
+        if self.preset_name in ("high", "auto"):
+            preset['fps'] = 60  # Override default 30fps
+        if self.renditions:
+            # The source is fetched (and the front end run) once, for the largest rendition
+            preset['max_size'] = max(r.max_size for r in self.renditions)
+        self.preset = preset
+
+        print(f"Processing: {url}")
+        print(f"Time range: {start_arg} to {end_arg}")
+        print(f"Quality: {self.preset_name}, FPS: {preset['fps']}")
+
+        post_id = extract_post_id(url)
+
+        # Renditions are several outputs: they skip the result cache (the source cache still applies)
+        if self.result_cache is not None and not self.renditions:
+            key_params = {"preset": "auto"} if self.preset_name == "auto" else preset
+            if self.output_format != "webp":
+                key_params = dict(key_params, format=self.output_format)
+            if self.decimate:
+                key_params = dict(key_params, decimate=True)
+            if self.per_scene:
+                key_params = dict(key_params, per_scene=True)
+            if self.target_bytes:
+                key_params = dict(key_params, target_bytes=self.target_bytes)
+            if self.slideshow_fps:
+                key_params = dict(key_params, slideshow_fps=self.slideshow_fps)
+            self.cache_key = ResultCache.make_key(post_id, _video_index(url), start_s, end_s, key_params)
+            # An "auto" result is stored under the extension of the format it picked
+            encoders = [ENCODERS[name]() for name in AUTO_FORMATS] if self.output_format == "auto" else [self.encoder]
+            cached = None
+            for encoder in encoders:
+                cached = self.result_cache.get(self.cache_key, encoder.ext)
+                if cached:
+                    self.trace.output_format = encoder.name
+                    break
+            if cached and self.output_format == "auto" and not in_memory:
+                out_name = os.path.splitext(out_name)[0] + encoder.ext
+            if cached and in_memory:
+                print("Cache hit.")
+                with open(cached, "rb") as f:
+                    self.result = f.read()
+                self.trace.finish(self.result)
+                return
+            if cached:
+                out_dir = os.path.dirname(out_name)
+                if out_dir:
+                    os.makedirs(out_dir, exist_ok=True)
+                shutil.copyfile(cached, out_name)
+                print(f"Cache hit. Saved: {out_name}")
+                self.result = out_name
+                self.trace.finish(self.result)
+                return
+
+        # Video posts: one source entry per clip; no index means the first clip
+        specific_index = _video_index(url)
+        crop_angle = self.crop_angle
+        # The downloaded rendition depends on the output size, so it is part of the key
+        video_key = f"{post_id}_{specific_index or 1}_{preset['max_size']}{'c' if crop_angle else ''}"
+        # Gallery images are fetched at the size variant covering the output,
+        # so the size is keyed too. No margin for the zoom: _slideshow_graph
+        # scales every image down to max_size before it zooms
+        min_side = preset['max_size']
+        images_key = f"{post_id}_images_{min_side}"
+
+        # Analyze URL at most once; every later stage reuses this metadata.
+        # It is fetched lazily so a source cache hit needs no network at all.
+        post = None
+
+        def get_post() -> PostInfo:
+            nonlocal post
+            if post is None:
+                try:
+                    post = self.post_cache.get(url) if self.post_cache else PostInfo.fetch(url)
+                except Exception as e:
+                    print(f"Failed to analyze URL: {e}")
+                    raise
+            return post
+
+        def load_images(dest_dir: str) -> List[str]:
+            post = get_post()
+            with span("download") as record:
+                images = download_twitter_images(url, dest_dir, post=post, fetcher=self.image_fetcher, min_side=min_side)
+                record["images"] = len(images)
+                record["bytes"] = sum(os.path.getsize(p) for p in images)
+            return images
 
-        input_video = None
-        temp_slideshow = None
-        downloaded_paths = []
+        def video_format() -> Optional[dict]:
+            # Smallest rendition that covers the output size (see select_format)
+            return select_format(_pick_entry(get_post(), specific_index or 1), preset['max_size'], crop_angle)
+
+        def load_video(dest_dir: str) -> List[str]:
+            post, format_spec = get_post(), format_spec_for(video_format())
+            with span("download") as record:
+                path = download_twitter_video(
+                    url,
+                    os.path.join(dest_dir, "video.%(ext)s"),
+                    video_index=specific_index or 1,
+                    post=post,
+                    format_spec=format_spec,
+                )
+                # Normalize to .mp4 if possible
+                base, _ = os.path.splitext(path)
+                candidate = base + ".mp4"
+                path = candidate if os.path.exists(candidate) else path
+                record["bytes"] = os.path.getsize(path)
+            return [path]
+
+        source_cached = source_cache is not None and source_cache.has(video_key)
+        if source_cached:
+            image_only = False
+        elif source_cache is not None and source_cache.has(images_key):
+            image_only = True
+        else:
+            image_only = is_image_only_post(get_post())
+
+        out_dir = os.path.dirname(out_name)
+        if out_dir and not in_memory:
+            os.makedirs(out_dir, exist_ok=True)
 
         # Detect image-only post
-        if is_image_only_post(info):
+        if image_only:
             print("Detected image-only post. Creating slideshow...")
-            with tempfile.TemporaryDirectory() as img_dir:
-                images = download_twitter_images(args.url, img_dir)
-                if not images:
-                    raise ValueError("No images found in the post.")
-                temp_slideshow = f"{post_id}_temp_slideshow.mp4"
-                input_video = build_slideshow_video(images, temp_slideshow, fps=preset['fps'])
+            images = stack.enter_context(_source_files(source_cache, images_key, load_images, self.work_dir))
+            if not images:
+                raise ValueError("No images found in the post.")
+            self.images = images
+            preset['fps'] = self.slideshow_fps or min(preset['fps'], SLIDESHOW_FPS)
+            print(f"Slideshow FPS: {preset['fps']}")
+            self.start_time, self.end_time = _trim_times(start_arg, end_arg, lambda: len(images) * SLIDESHOW_SECONDS_PER_IMAGE)
+            return
+
+        print("Detected video post.")
+        if specific_index:
+            print(f"Detected specific video index: {specific_index}")
         else:
-            print("Detected video post.")
-
-            # Detect /video/N for specific clip
-            m = re.search(r"/video/(\d+)", args.url)
-            specific_index = int(m.group(1)) if m else None
-
-            if specific_index:
-                print(f"Detected specific video index: {specific_index}")
-                downloaded_path = download_twitter_video(
-                    args.url,
-                    f"{post_id}_video{specific_index}.%(ext)s",
-                    video_index=specific_index
+            print("No specific video index provided. Using first available video...")
+
+        # A short window of a longer video is read straight from the remote
+        # stream with input seeking, so only the covering bytes are fetched.
+        # In memory mode without a source cache every uncached video is
+        # streamed this way; with one, the download fills the cache so later
+        # trims and presets of the post skip the network.
+        remote = None
+        stream_whole = in_memory and source_cache is None
+        if (self.ranged or stream_whole) and not source_cached:
+            entry = _pick_entry(get_post(), specific_index or 1)
+            remote = _remote_window_input(entry, start_s, end_s, fmt=video_format(), whole=stream_whole)
+            # (a piped stream can only be read once, so budget mode downloads instead)
+            if remote is None and stream_whole and entry is not None and not self.target_bytes:
+                fmt = video_format()
+                proc = _open_ytdlp_stream(entry, format_spec_for(fmt))
+                stack.callback(_reap, proc)
+                self.input_video, self.input_stream = "pipe:0", proc.stdout
+                self.media_info = MediaInfo.from_format(fmt or entry, entry.get('duration'))
+                print("Streaming the video from yt-dlp into ffmpeg")
+        if remote:
+            self.input_video, self.input_headers, self.media_info = remote
+            print("Reading the video straight from the remote stream")
+        elif self.input_stream is None:
+            videos = stack.enter_context(_source_files(source_cache, video_key, load_video, self.work_dir))
+            if not videos:
+                raise ValueError("No videos found in the post.")
+            self.input_video = videos[0]
+
+        def video_duration() -> float:
+            if self.media_info is None:
+                self.media_info = probe_media(self.input_video)
+            if self.input_stream is not None and not self.media_info.duration:
+                return float("inf")  # unknown length: always apply the default cap
+            return self.media_info.duration
+
+        self.start_time, self.end_time = _trim_times(start_arg, end_arg, video_duration)
+
+        if self.preset_name == "auto":
+            if self.input_stream is not None:
+                print("Auto preset: a piped stream cannot be analyzed ahead of the encode; using high")
+            else:
+                stats = analyze_content(self.input_video, self.start_time, self.end_time, self.input_headers)
+                self.preset = auto_preset(stats)
+                print(
+                    f"Auto preset: {self.preset['auto']['kind']} "
+                    f"(motion {stats.motion:.2f}, scene cuts/s {stats.scene_rate:.2f}, static {stats.static_ratio:.0%}) -> "
+                    f"fps {self.preset['fps']}, max_size {self.preset['max_size']}, "
+                    f"quality {self.preset['webp_quality']}, denoise {'on' if self.preset['quality_boost'] else 'off'}, "
+                    f"decimate {'on' if self.preset['decimate'] else 'off'}"
+                )
+        if self.media_info is None:
+            self.media_info = probe_media(self.input_video, self.input_headers)
+        # Logged once here: the encoders build their filters per chunk or sample
+        video_fps = self.media_info.fps
+        print(f"Video FPS: {float(video_fps):g}, Config FPS: {self.preset['fps']}")
+        if 0 < video_fps < self.preset['fps']:
+            print(f"Adjusting FPS to match video: {video_fps}")
+        self.trace.preset = {k: self.preset[k] for k in ("fps", "max_size", "webp_quality", "quality_boost", "decimate", "auto") if k in self.preset}
+
+    def render(self):
+        """Encode the prepared source and store it in the result cache; returns bytes or the output path."""
+        with self._tracing():
+            return self._render()
+
+    def _render(self):
+        if self.result is not None:
+            return self.result
+        if self.renditions:
+            return self._render_renditions()
+        encoder = self.encoder
+        print(f"Converting to {encoder.name.upper()} -> {self.out_name}")
+        try:
+            if self.images is not None:
+                args = self._slideshow_args()
+                result = encoder.encode_slideshow(
+                    self.images, self.out_name, self.preset, args['seconds_per_image'],
+                    args['start_s'], args['end_s'], target_bytes=self.target_bytes,
                 )
-                input_video = downloaded_path
             else:
-                print("No specific video index provided. Downloading first available video...")
-                downloaded_paths = download_twitter_video(args.url, f"{post_id}_%(id)s.%(ext)s")
-                if not downloaded_paths:
-                    raise ValueError("No videos found in the post.")
-                input_video = downloaded_paths[0]
-
-            # Normalize to .mp4 if possible
-            base, _ = os.path.splitext(input_video)
-            candidate = base + ".mp4"
-            if os.path.exists(candidate):
-                input_video = candidate
-
-        # Handle trimming
-        start_time = None
-        end_time = None
-
-        if args.start_time == "00:00" and args.end_time == "00:00":
-            video_duration = _get_video_duration(input_video)
-            print(f"Video duration: {video_duration} seconds")
-            if video_duration > 8:
-                print("Video is longer than 8 seconds, limiting to 8 seconds")
-                end_time = "00:08"
-        elif args.start_time != "00:00" and args.end_time != "00:00":
-            start_time = args.start_time
-            end_time = args.end_time
-        elif args.start_time != "00:00" and args.end_time == "00:00":
-            start_time = args.start_time
-        elif args.start_time == "00:00" and args.end_time != "00:00":
-            end_time = args.end_time
-
-        # Convert to WebP
-        print(f"Converting to WebP -> {out_name}")
-        os.makedirs(os.path.dirname(out_name), exist_ok=True)
+                result = encoder.encode_video(
+                    self.input_video, self.out_name, self.preset,
+                    target_bytes=self.target_bytes,
+                    crop_angle=self.crop_angle,
+                    start_time=self.start_time,
+                    end_time=self.end_time,
+                    input_headers=self.input_headers,
+                    media_info=self.media_info,
+                    stdin=self.input_stream,
+                )
+        finally:
+            self.close()
+        return self._store(result)
+
+    def _render_renditions(self):
+        if self.target_bytes:
+            print("Warning: the size budget does not apply to renditions")
+        try:
+            if self.images is not None:
+                args = self._slideshow_args()
+                encode_renditions(
+                    self.renditions, self.preset, images=self.images,
+                    seconds_per_image=args['seconds_per_image'], start_s=args['start_s'], end_s=args['end_s'],
+                    decimate=self.decimate,
+                )
+            else:
+                encode_renditions(
+                    self.renditions, self.preset, input_video=self.input_video,
+                    crop_angle=self.crop_angle,
+                    start_time=self.start_time,
+                    end_time=self.end_time,
+                    input_headers=self.input_headers,
+                    media_info=self.media_info,
+                    stdin=self.input_stream,
+                    decimate=self.decimate,
+                )
+        finally:
+            self.close()
+        self.result = self.renditions
+        self.trace.finish(None)
+        self.trace.output_bytes = 0
+        for r in self.renditions:
+            meta = r.metadata()
+            self.trace.output_bytes += meta["bytes"]
+            print(f"Done. {r.name}: {meta['width']}x{meta['height']} {r.output_format}, {meta['bytes']} bytes"
+                  + (f" -> {r.result}" if r.output != "-" else ""))
+        return self.renditions
 
-        convert_video_to_webp(
-            input_video,
-            out_name,
+    def _encode_args(self) -> dict:
+        preset = self.preset
+        return dict(
             max_size=preset['max_size'],
             fps=preset['fps'],
             webp_quality=preset['webp_quality'],
             lossless=False,
-            crop_angle=None,
-            start_time=start_time,
-            end_time=end_time,
+            crop_angle=self.crop_angle,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            quality_boost=preset.get('quality_boost', False),
+            input_headers=self.input_headers,
+            media_info=self.media_info,
+            decimate=self.decimate or preset.get('decimate', False),
+        )
+
+    def _slideshow_args(self) -> dict:
+        preset = self.preset
+        return dict(
+            max_size=preset['max_size'],
+            fps=preset['fps'],
+            webp_quality=preset['webp_quality'],
+            seconds_per_image=SLIDESHOW_SECONDS_PER_IMAGE,
+            start_s=parse_time(self.start_time) if self.start_time else None,
+            end_s=parse_time(self.end_time) if self.end_time else None,
             quality_boost=preset.get('quality_boost', False),
+            decimate=self.decimate or preset.get('decimate', False),
         )
 
-        print(f"Done. Saved: {out_name}")
+    async def render_async(self):
+        """
+        render() with every ffmpeg run as an asyncio subprocess. Budget mode
+        (many dependent trial encodes), renditions and formats other than WebP
+        run render() on a worker thread instead.
+        """
+        with self._tracing():
+            return await self._render_async()
+
+    async def _render_async(self):
+        if self.result is not None:
+            return self.result
+        if self.target_bytes or self.renditions or self.output_format != "webp":
+            return await asyncio.to_thread(self.render)
+        out_name = self.out_name
+        print(f"Converting to WebP -> {out_name}")
+        try:
+            if self.images is not None:
+                _require_cmd("ffmpeg")
+                args = self._slideshow_args()
+                cmd = _slideshow_webp_cmd(
+                    self.images, args['max_size'], args['fps'], args['webp_quality'],
+                    args['seconds_per_image'], args['start_s'], args['end_s'], args['quality_boost'],
+                    args['decimate'],
+                )
+                print(f"Encoding {len(self.images)} images to WebP slideshow")
+                with span("slideshow", images=len(self.images)):
+                    result = await _run_webp_encode_async(cmd, out_name)
+                if args['decimate']:
+                    result = _hold_last_frame(result, _slideshow_seconds(
+                        len(self.images), args['seconds_per_image'], args['start_s'], args['end_s']))
+            else:
+                result = await convert_video_to_webp_async(
+                    self.input_video, out_name, stdin=self.input_stream,
+                    workers=self.encode_workers, **self._encode_args())
+        finally:
+            self.close()
+        return self._store(result)
+
+    def _store(self, result):
+        """Put a finished result in the result cache and report it."""
+        # "auto" records the encoder it picked, and a file output takes its extension
+        encoder = getattr(self.encoder, "chosen", None) or self.encoder
+        self.trace.output_format = encoder.name
+        if not self.in_memory:
+            self.out_name = result
+        out_name = self.out_name
+        if self.cache_key is not None:
+            try:
+                if self.in_memory:
+                    self.result_cache.put_bytes(self.cache_key, result, encoder.ext)
+                else:
+                    self.result_cache.put(self.cache_key, result, encoder.ext)
+            except OSError as e:
+                print(f"Warning: could not store result in cache ({e})")
+
+        self.result = result
+        self.trace.finish(result)
+        if self.in_memory:
+            print(f"Done. {len(result)} bytes")
+        else:
+            print(f"Done. Saved: {out_name}")
+        return result
+
+def convert_post(
+    url: str,
+    start_arg: str,
+    end_arg: str,
+    out_name: str,
+    work_dir: str = ".",
+    result_cache: Optional[ResultCache] = _RESULT_CACHE,
+    source_cache: Optional[SourceCache] = _SOURCE_CACHE,
+    ranged: bool = True,
+    target_bytes: Optional[int] = None,
+    encode_workers: Optional[int] = None,
+    preset: str = "high",
+    trace: Optional[Trace] = None,
+    decimate: bool = False,
+    output_format: str = "webp",
+    per_scene: bool = False,
+    renditions: Optional[List[Rendition]] = None,
+    slideshow_fps: Optional[int] = None,
+):
+    """
+    Run the full pipeline for one post: analyze, download, (slideshow), trim and encode.
+    result_cache and source_cache skip repeated work (None disables them), and ranged
+    reads short trims remotely. out_name "-" runs in memory, streaming the source
+    when there is no source_cache. target_bytes sets a size budget, output_format
+    the encoder (see ENCODERS) and renditions several outputs from one decode.
+    """
+    conversion = Conversion(
+        url, start_arg, end_arg, out_name,
+        work_dir=work_dir,
+        result_cache=result_cache,
+        source_cache=source_cache,
+        ranged=ranged,
+        target_bytes=target_bytes,
+        encode_workers=encode_workers,
+        preset=preset,
+        trace=trace,
+        decimate=decimate,
+        output_format=output_format,
+        per_scene=per_scene,
+        renditions=renditions,
+        slideshow_fps=slideshow_fps,
+    )
+    try:
+        conversion.prepare()
+        return conversion.render()
+    finally:
+        conversion.close()
+
+class SchedulerBusy(Exception):
+    """Raised by JobScheduler.submit() when max_jobs jobs are already admitted."""
+
+class JobScheduler:
+    """
+    Runs conversions as jobs: downloads on io_workers threads, encodes on cpu_workers
+    threads. At most max_jobs are admitted (SchedulerBusy beyond); a job past its
+    deadline fails with JobCancelled and its ffmpeg processes are killed.
+    """
+
+    def __init__(
+        self,
+        io_workers: int = 4,
+        cpu_workers: Optional[int] = None,
+        max_jobs: int = 16,
+        deadline: Optional[float] = 300.0,
+        result_cache: Optional[ResultCache] = _RESULT_CACHE,
+        source_cache: Optional[SourceCache] = _SOURCE_CACHE,
+    ):
+        self.io_workers = max(1, io_workers)
+        self.cpu_workers = max(1, cpu_workers or os.cpu_count() or 1)
+        self.max_jobs = max_jobs
+        self.deadline = deadline
+        self.result_cache = result_cache
+        self.source_cache = source_cache
+        self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="gifpy-io")
+        self._cpu_pool = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix="gifpy-cpu")
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._active = 0
+        self._active_lock = threading.Lock()
 
-        # Cleanup
+    @property
+    def active(self) -> int:
+        """Jobs admitted and not yet finished."""
+        return self._active
+
+    def submit(
+        self,
+        url: str,
+        start_arg: str,
+        end_arg: str,
+        out_name: str = "-",
+        deadline: Optional[float] = None,
+        **options,
+    ) -> Job:
+        """
+        Queue one convert_post() call; options are passed through to it. The
+        returned Job's result() is the WebP or GIF bytes (or output path). deadline
+        overrides the scheduler default, in seconds from now.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise SchedulerBusy(f"{self.max_jobs} jobs already queued")
+        with self._active_lock:
+            self._active += 1
+
+        def release_slot():
+            with self._active_lock:
+                self._active -= 1
+            self._slots.release()
+
+        job = Job(deadline if deadline is not None else self.deadline)
+        options.setdefault("result_cache", self.result_cache)
+        options.setdefault("source_cache", self.source_cache)
+        work_dir = None
         try:
-            if specific_index:
-                if input_video and os.path.exists(input_video):
-                    os.remove(input_video)
-                    print(f"Removed temp video: {input_video}")
+            work_dir = tempfile.TemporaryDirectory(prefix="gifpy_")
+            # Bad options (e.g. an unknown output_format) raise here
+            conversion = Conversion(url, start_arg, end_arg, out_name, work_dir=work_dir.name, **options)
+        except BaseException:
+            if work_dir is not None:
+                work_dir.cleanup()
+            release_slot()
+            raise
+        job.trace = conversion.trace
+
+        timer = None
+        if job.deadline is not None:
+            timer = threading.Timer(job.deadline - time.monotonic(), job.cancel, args=("deadline exceeded",))
+            timer.daemon = True
+            timer.start()
+
+        def release():
+            if timer is not None:
+                timer.cancel()
+            conversion.close()
+            work_dir.cleanup()
+            release_slot()
+
+        def run_stage(stage: Callable, then: Optional[Callable]):
+            token = _CURRENT_JOB.set(job)
+            try:
+                job.check()
+                stage()
+                job.check()
+            except BaseException as e:
+                # Free the slot first, so a caller woken by the future can submit again
+                release()
+                job.finish(exc=e)
+                return
+            finally:
+                _CURRENT_JOB.reset(token)
+            if then is not None and conversion.result is None:
+                try:
+                    then()
+                except BaseException as e:
+                    # e.g. the CPU pool has been shut down
+                    release()
+                    job.finish(exc=e)
             else:
-                for path in downloaded_paths:
-                    if os.path.exists(path):
-                        os.remove(path)
-                        print(f"Removed temp video: {path}")
-            if temp_slideshow and os.path.exists(temp_slideshow):
-                os.remove(temp_slideshow)
-                print(f"Removed temp slideshow: {temp_slideshow}")
+                release()
+                job.finish(conversion.result)
+
+        def render():
+            self._cpu_pool.submit(run_stage, conversion.render, None)
+
+        try:
+            self._io_pool.submit(run_stage, conversion.prepare, render)
+        except BaseException:
+            release()
+            raise
+        return job
+
+    def shutdown(self, cancel: bool = False):
+        self._io_pool.shutdown(wait=not cancel, cancel_futures=cancel)
+        self._cpu_pool.shutdown(wait=not cancel, cancel_futures=cancel)
+
+def _expand_batch(jobs, posts: PostInfoCache):
+    """
+    Yield the jobs of a batch, replacing each all_videos job with one job per
+    video of its post. A job whose post cannot be analyzed is yielded with the
+    error under "error".
+    """
+    for job in jobs:
+        if not job.get("all_videos"):
+            yield job
+            continue
+        try:
+            post = posts.get(job["url"])
         except Exception as e:
-            print(f"Warning: could not remove temp files ({e})")
+            yield dict(job, error=e)
+            continue
+        base = re.sub(r"/(?:video|photo)/\d+/?$", "", job["url"].split("?")[0])
+        entries = post.entries
+        if not entries or is_image_only_post(post):
+            yield dict(job, all_videos=False)
+            continue
+        for n in range(1, len(entries) + 1):
+            yield dict(job, url=f"{base}/video/{n}", all_videos=False)
+
+def convert_batch(jobs, out_dir: Optional[str] = None, scheduler: Optional[JobScheduler] = None, **options):
+    """
+    Convert many jobs and yield (job, result, error) as each finishes. A job is a dict
+    with url and optionally start_time, end_time, preset, output and all_videos; with
+    out_dir outputs are named <post id>_<video index>_<job number>. options go to
+    convert_post().
+    """
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = JobScheduler(deadline=None)
+    posts = PostInfoCache()
+    pending = {}
+
+    def finished(block: bool):
+        done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = pending.pop(future)
+            error = future.exception()
+            yield job, None if error else future.result(), error
+
+    try:
+        for n, job in enumerate(_expand_batch(jobs, posts), start=1):
+            if job.get("error") is not None:
+                yield job, None, job.pop("error")
+                continue
+            output = job.get("output")
+            if not output:
+                if out_dir:
+                    idx = _video_index(job["url"]) or 1
+                    # ("auto" replaces the extension with the format it picks)
+                    ext = ENCODERS.get(options.get("output_format") or "webp", WebPEncoder).ext
+                    output = os.path.join(out_dir, f"{extract_post_id(job['url'])}_{idx}_{n}{ext}")
+                else:
+                    output = "-"
+            job = dict(job, output=output)
+            while True:
+                try:
+                    submitted = scheduler.submit(
+                        job["url"],
+                        job.get("start_time") or "00:00",
+                        job.get("end_time") or "00:00",
+                        output,
+                        preset=job.get("preset") or "high",
+                        post_cache=posts,
+                        **options,
+                    )
+                    break
+                except SchedulerBusy:
+                    if pending:
+                        yield from finished(block=True)
+                    else:
+                        time.sleep(0.1)  # slots held by other callers or cancelled jobs
+            pending[submitted.future] = dict(job, trace=submitted.trace)
+            yield from finished(block=False)
+        while pending:
+            yield from finished(block=True)
+    finally:
+        if own_scheduler:
+            scheduler.shutdown(cancel=True)
+
+def read_batch_file(path: str) -> List[dict]:
+    """
+    Read batch jobs, one per line: a JSON object (see convert_batch) or
+    "url [start_time end_time [preset]]". Blank lines and # comments are skipped.
+    """
+    jobs = []
+    with (nullcontext(sys.stdin) if path == "-" else open(path, encoding="utf-8")) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                jobs.append(json.loads(line))
+                continue
+            fields = line.split()
+            job = {"url": fields[0]}
+            if len(fields) >= 3:
+                job["start_time"], job["end_time"] = fields[1], fields[2]
+            if len(fields) >= 4:
+                job["preset"] = fields[3]
+            jobs.append(job)
+    return jobs
+
+async def _run_async(cmd: List[str], check: bool = False, stdin=None) -> subprocess.CompletedProcess:
+    """_run on an asyncio subprocess; cancelling the awaiting task kills the process."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=stdin, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await proc.communicate()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+async def _run_webp_encode_async(cmd: List[str], output_webp: str, stdin=None):
+    """_run_webp_encode on an asyncio subprocess."""
+    if output_webp == "-":
+        result = await _run_async(cmd + ["pipe:1"], check=True, stdin=stdin)
+        return _fix_piped_webp(result.stdout)
+    await _run_async(cmd + [output_webp], check=True, stdin=stdin)
+    return output_webp
+
+async def probe_media_async(input_video: str, input_headers: Optional[dict] = None) -> MediaInfo:
+    _require_cmd("ffprobe")
+    with span("probe"):
+        return _parse_probe((await _run_async(_probe_cmd(input_video, input_headers))).stdout)
+
+async def convert_video_to_webp_async(
+    input_video: str,
+    output_webp: str,
+    max_size: int = 300,
+    fps: int = 20,
+    webp_quality: int = 85,
+    lossless: bool = False,
+    crop_angle: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    quality_boost: bool = False,
+    input_headers: Optional[dict] = None,
+    media_info: Optional[MediaInfo] = None,
+    stdin=None,
+    min_quality: int = 50,
+    workers: Optional[int] = None,
+    min_chunk_seconds: float = 1.0,
+    decimate: bool = False,
+):
+    """
+    convert_video_to_webp on asyncio subprocesses. A seekable input is split
+    into chunks as in convert_video_to_webp_parallel and the chunk encodes run
+    concurrently; a stdin stream is encoded in one pass.
+    """
+    _require_cmd("ffmpeg")
+    if media_info is None:
+        media_info = await probe_media_async(input_video, input_headers) if stdin is None else MediaInfo()
+    plan = None
+    if stdin is None and not decimate:
+        plan = _chunk_plan(fps, start_time, end_time, media_info, workers, min_chunk_seconds)
+    if plan is None:
+        plan = [(start_time, end_time, None)]
+
+    def cmd_for(chunk) -> List[str]:
+        chunk_start, chunk_end, frames = chunk
+        return _video_webp_cmd(
+            input_video, media_info, max_size, fps, webp_quality, lossless, crop_angle,
+            chunk_start, chunk_end, quality_boost, input_headers, min_quality, frames, decimate,
+        )
+
+    async def encode(chunk, output: str, stdin=None):
+        with span("encode", start=chunk[0], end=chunk[1], quality=webp_quality):
+            return await _run_webp_encode_async(cmd_for(chunk), output, stdin=stdin)
+
+    if len(plan) == 1:
+        result = await encode(plan[0], output_webp, stdin=stdin)
+        if decimate:
+            result = _hold_last_frame(result, _clip_seconds(start_time, end_time, media_info))
+        return result
+    parts = await asyncio.gather(*(encode(chunk, "-") for chunk in plan))
+    data = join_animated_webp(parts)
+    if output_webp == "-":
+        return data
+    with open(output_webp, "wb") as f:
+        f.write(data)
+    return output_webp
+
+class AsyncImageFetcher:
+    """
+    KeepAliveFetcher's download_all() with plain HTTP/1.0 GETs on an asyncio loop.
+    Redirects are followed; errors, short bodies, 429 and 5xx are retried.
+    """
+    RETRY_STATUSES = KeepAliveFetcher.RETRY_STATUSES
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, timeout: float = 15, retries: int = 3, backoff: float = 0.5):
+        self.loop = loop
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._ssl = ssl.create_default_context()
+
+    async def _get(self, url: str):
+        """One GET; returns (status, headers, body)."""
+        parsed = urllib.parse.urlsplit(url)
+        secure = parsed.scheme == "https"
+        host = parsed.hostname
+        port = parsed.port or (443 if secure else 80)
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl if secure else None, server_hostname=host if secure else None)
+        try:
+            target = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+            writer.write(
+                f"GET {target} HTTP/1.0\r\nHost: {parsed.netloc}\r\n"
+                f"User-Agent: Mozilla/5.0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            status = int(lines[0].split()[1])
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            if "content-length" in headers:
+                # A connection closed early raises IncompleteReadError (retried)
+                # instead of passing a truncated image off as complete
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+        finally:
+            writer.close()
+        return status, headers, body
+
+    async def download(self, url: str, path: str) -> str:
+        """GET url into path (following up to 3 redirects). Returns path."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)))
+            target = url
+            try:
+                for _ in range(4):
+                    status, headers, body = await asyncio.wait_for(self._get(target), self.timeout)
+                    if status in (301, 302, 303, 307, 308) and headers.get("location"):
+                        target = urllib.parse.urljoin(target, headers["location"])
+                        continue
+                    if status != 200:
+                        raise urllib.error.HTTPError(target, status, "", None, None)
+                    with open(path, "wb") as out_file:
+                        out_file.write(body)
+                    return path
+                raise urllib.error.URLError(f"Too many redirects for {url}")
+            except urllib.error.HTTPError as e:
+                if e.code not in self.RETRY_STATUSES:
+                    raise
+                last_error = e
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, IndexError, OSError) as e:
+                last_error = e
+        raise last_error
+
+    async def download_all_async(self, urls: List[str], paths: List[str]) -> list:
+        return await asyncio.gather(*(self.download(u, p) for u, p in zip(urls, paths)), return_exceptions=True)
 
-    except subprocess.CalledProcessError as e:
+    def download_all(self, urls: List[str], paths: List[str], max_workers: int = 4) -> list:
+        """Blocking entry point for worker threads; max_workers is ignored (all run at once)."""
+        return asyncio.run_coroutine_threadsafe(self.download_all_async(urls, paths), self.loop).result()
+
+async def convert_async(
+    url: str,
+    start_arg: str = "00:00",
+    end_arg: str = "00:00",
+    preset: str = "high",
+    target_bytes: Optional[int] = None,
+    result_cache: Optional[ResultCache] = _RESULT_CACHE,
+    source_cache: Optional[SourceCache] = _SOURCE_CACHE,
+    post_cache: Optional[PostInfoCache] = None,
+) -> bytes:
+    """
+    convert_post(url, start_arg, end_arg, "-") for asyncio code: yt-dlp runs in the
+    default thread pool, image fetches and ffmpeg on the loop. Cancelling kills ffmpeg.
+    """
+    loop = asyncio.get_running_loop()
+    work_dir = tempfile.TemporaryDirectory(prefix="gifpy_")
+    conversion = Conversion(
+        url, start_arg, end_arg, "-",
+        work_dir=work_dir.name,
+        result_cache=result_cache,
+        source_cache=source_cache,
+        target_bytes=target_bytes,
+        preset=preset,
+        post_cache=post_cache,
+        image_fetcher=AsyncImageFetcher(loop),
+    )
+
+    def cleanup(_=None):
+        conversion.close()
+        work_dir.cleanup()
+
+    prepare = loop.run_in_executor(None, contextvars.copy_context().run, conversion.prepare)
+    try:
+        await asyncio.shield(prepare)
+    except asyncio.CancelledError:
+        # The thread cannot be interrupted; clean up once it returns
+        prepare.add_done_callback(cleanup)
+        raise
+    except BaseException:
+        cleanup()
+        raise
+    try:
+        return await conversion.render_async()
+    finally:
+        cleanup()
+
+def _reap(proc: subprocess.Popen):
+    """
+    Stop a helper process feeding ffmpeg once it is no longer needed. A helper
+    that had already exited on its own with an error raises RuntimeError with
+    the end of its stderr, rather than leaving only ffmpeg's "invalid data".
+    """
+    exited = proc.poll() is not None
+    if not exited and proc.stdout:
+        # EOF on the pipe means the helper finished writing and is about to
+        # exit; otherwise ffmpeg stopped reading early and the helper is stopped
+        os.set_blocking(proc.stdout.fileno(), False)
+        try:
+            finished = not os.read(proc.stdout.fileno(), 1)
+        except BlockingIOError:
+            finished = False
+        if finished:
+            try:
+                proc.wait(timeout=10)
+                exited = True
+            except subprocess.TimeoutExpired:
+                pass
+    if proc.stdout:
+        proc.stdout.close()
+    if not exited:
+        proc.terminate()
+    proc.wait()
+    job = _CURRENT_JOB.get()
+    if job is not None:
+        job.detach(proc)
+    log = getattr(proc, "log", None)
+    message = ""
+    if log is not None:
+        log.seek(0)
+        message = log.read().decode(errors="ignore").strip()[-500:]
+        log.close()
+        os.remove(proc.info_file)
+    if exited and proc.returncode != 0:
+        raise RuntimeError(f"yt-dlp stream failed (exit {proc.returncode})" + (f": {message}" if message else ""))
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, subprocess.CalledProcessError):
         msg = "ffmpeg failed during conversion."
         if e.stderr:
             dec = e.stderr.decode(errors='ignore') if isinstance(e.stderr, bytes) else str(e.stderr)
             msg += "\n" + dec[:500]
-        print(msg)
-        sys.exit(1)
+        return msg
+    return f"Error: {e}"
+
+class Metrics:
+    """
+    Process-wide counters for server mode, served on GET /metrics in the
+    Prometheus text format: jobs by status, per-stage wall and child CPU time,
+    output bytes and frames, and the scheduler's jobs in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self.stages = {}
+        self.output_bytes = 0
+        self.frames = 0
+
+    def observe(self, status: str, trace: Optional[Trace] = None):
+        with self._lock:
+            self.jobs[status] = self.jobs.get(status, 0) + 1
+            if trace is None:
+                return
+            for stage, t in trace.stage_totals().items():
+                total = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0})
+                for k in total:
+                    total[k] += t[k]
+            self.output_bytes += trace.output_bytes or 0
+            self.frames += trace.frames or 0
+
+    def render(self, scheduler: Optional[JobScheduler] = None) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+
+        with self._lock:
+            metric("gifpy_jobs_total", "counter", "Finished conversion jobs by status.",
+                   [({"status": k}, v) for k, v in sorted(self.jobs.items())])
+            metric("gifpy_stage_runs_total", "counter", "Pipeline stage runs.",
+                   [({"stage": k}, v["count"]) for k, v in sorted(self.stages.items())])
+            metric("gifpy_stage_seconds_total", "counter", "Wall time spent per pipeline stage.",
+                   [({"stage": k}, v["seconds"]) for k, v in sorted(self.stages.items())])
+            metric("gifpy_stage_cpu_seconds_total", "counter", "Child process CPU time per pipeline stage.",
+                   [({"stage": k}, v["cpu_seconds"]) for k, v in sorted(self.stages.items())])
+            metric("gifpy_output_bytes_total", "counter", "Bytes of WebP produced.", [({}, self.output_bytes)])
+            metric("gifpy_output_frames_total", "counter", "Animation frames produced.", [({}, self.frames)])
+        if scheduler is not None:
+            metric("gifpy_jobs_in_flight", "gauge", "Jobs admitted and not yet finished.", [({}, scheduler.active)])
+            metric("gifpy_jobs_max", "gauge", "Admission limit.", [({}, scheduler.max_jobs)])
+        if resource:
+            metric("gifpy_peak_rss_kilobytes", "gauge", "Peak RSS of the server process.",
+                   [({}, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)])
+        return "\n".join(lines) + "\n"
+
+class ConvertRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /convert with JSON {url, start_time, end_time[, max_bytes, preset, decimate, format, per_scene, slideshow_fps]}
+    -> the output bytes (image/webp, image/gif, video/mp4 or image/avif; "auto" picks the
+    fastest that fits max_bytes), with the job's trace summary as JSON in the X-Gifpy-Trace header.
+    With "renditions": [{name, max_size[, fps, format]}] the clip is decoded once for all of
+    them and the reply is JSON: {"renditions": [metadata with the base64 output under "data"]}.
+    GET /health -> 200 once the server is accepting work.
+    GET /metrics -> Prometheus text format counters (see Metrics).
+    """
+    server_version = "gifpy/1.0"
+
+    def _send(self, status: int, body: bytes, content_type: str = "text/plain; charset=utf-8", headers: Optional[dict] = None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, b"ok")
+        elif self.path == "/metrics":
+            body = self.server.metrics.render(self.server.scheduler).encode()
+            self._send(200, body, "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send(404, b"Not found")
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self._send(404, b"Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            url = payload["url"]
+            start_arg = payload.get("start_time") or "00:00"
+            end_arg = payload.get("end_time") or "00:00"
+            target_bytes = int(payload.get("max_bytes") or self.server.target_bytes or 0) or None
+            preset = payload.get("preset") or "high"
+            decimate = bool(payload.get("decimate"))
+            output_format = payload.get("format") or "webp"
+            per_scene = bool(payload.get("per_scene"))
+            slideshow_fps = int(payload.get("slideshow_fps") or 0) or None
+            renditions = [
+                Rendition(str(r["name"]), int(r["max_size"]), int(r["fps"]) if r.get("fps") else None, r.get("format") or "webp")
+                for r in payload.get("renditions") or []
+            ]
+            if preset not in PRESET_NAMES:
+                raise ValueError(f"unknown preset {preset!r}")
+            if output_format not in OUTPUT_FORMATS:
+                raise ValueError(f"unknown format {output_format!r}")
+            if slideshow_fps is not None and not 1 <= slideshow_fps <= 60:
+                raise ValueError("slideshow_fps must be between 1 and 60")
+            if start_arg != "00:00":
+                parse_time(start_arg)
+            if end_arg != "00:00":
+                parse_time(end_arg)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, f"Bad request: {e}".encode())
+            return
+
+        try:
+            job = self.server.scheduler.submit(
+                url, start_arg, end_arg, "-", target_bytes=target_bytes, preset=preset, decimate=decimate,
+                output_format=output_format, per_scene=per_scene, renditions=renditions or None,
+                slideshow_fps=slideshow_fps,
+            )
+        except SchedulerBusy as e:
+            self.server.metrics.observe("rejected")
+            self.send_response(503)
+            self.send_header("Retry-After", "5")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            print(f"Rejected {url}: {e}")
+            return
+        try:
+            data = job.result()
+        except JobCancelled as e:
+            self.server.metrics.observe("cancelled", job.trace)
+            print(str(e))
+            self._send(504, str(e).encode())
+            return
+        except Exception as e:
+            self.server.metrics.observe("failed", job.trace)
+            msg = _describe_error(e)
+            print(msg)
+            self._send(500, msg.encode())
+            return
+        self.server.metrics.observe("ok", job.trace)
+        summary = job.trace.summary()
+        summary["stages"] = job.trace.stage_totals()
+        del summary["spans"]
+        if renditions:
+            body = {"renditions": [dict(r.metadata(), data=base64.b64encode(r.result).decode()) for r in data]}
+            data, mime = json.dumps(body).encode(), "application/json"
+        else:
+            mime = ENCODERS[job.trace.output_format or "webp"].mime
+        self._send(200, data, mime, {"X-Gifpy-Trace": json.dumps(summary, separators=(",", ":"))})
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 5000,
+    workers: int = 2,
+    use_cache: bool = True,
+    target_bytes: Optional[int] = None,
+    io_workers: int = 4,
+    max_jobs: int = 16,
+    deadline: Optional[float] = 300.0,
+):
+    """
+    Run the long-lived conversion server with yt_dlp kept warm. Requests become
+    JobScheduler jobs; beyond max_jobs it answers 503, past the deadline 504.
+    """
+    _YDL_POOL.size = max(_YDL_POOL.size, io_workers)
+    _YDL_POOL.warm()
+    httpd = ThreadingHTTPServer((host, port), ConvertRequestHandler)
+    httpd.daemon_threads = True
+    httpd.scheduler = JobScheduler(
+        io_workers=io_workers,
+        cpu_workers=workers,
+        max_jobs=max_jobs,
+        deadline=deadline,
+        result_cache=_RESULT_CACHE if use_cache else None,
+        source_cache=_SOURCE_CACHE if use_cache else None,
+    )
+    httpd.target_bytes = target_bytes
+    httpd.metrics = Metrics()
+    print(f"Serving on http://{host}:{port} ({io_workers} download / {workers} encode workers, {max_jobs} jobs max)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        httpd.scheduler.shutdown(cancel=True)
+
+def run_batch(jobs: List[dict], args) -> int:
+    """
+    CLI batch mode: write one JSON line per finished job to stdout (progress
+    goes to stderr). Returns the exit status: 1 if any job failed.
+    """
+    os.makedirs(args.out_dir, exist_ok=True)
+    _YDL_POOL.size = max(_YDL_POOL.size, args.io_workers)
+    scheduler = JobScheduler(
+        io_workers=args.io_workers,
+        cpu_workers=args.workers,
+        max_jobs=args.max_jobs,
+        deadline=args.deadline or None,
+        result_cache=None if args.no_cache else _RESULT_CACHE,
+        source_cache=None if args.no_cache else _SOURCE_CACHE,
+    )
+    # stdout carries the JSON lines, so a job cannot write its output there
+    jobs = [
+        dict(job, error=ValueError('"output": "-" is not supported in batch mode')) if job.get("output") == "-" else job
+        for job in jobs
+    ]
+    failed = 0
+    out = sys.stdout
+    with redirect_stdout(sys.stderr):
+        results = convert_batch(
+            jobs, out_dir=args.out_dir, scheduler=scheduler,
+            ranged=not args.full_download,
+            target_bytes=args.max_bytes,
+            encode_workers=args.encode_workers,
+            decimate=args.decimate,
+            output_format=args.format,
+            per_scene=args.per_scene,
+            slideshow_fps=args.slideshow_fps,
+        )
+        for job, result, error in results:
+            record = {k: job.get(k) for k in ("url", "start_time", "end_time", "preset", "output")}
+            if error is not None:
+                failed += 1
+                record["error"] = _describe_error(error)
+            else:
+                record["output"] = result  # "--format auto" may have changed the extension
+                record["bytes"] = os.path.getsize(result)
+            if args.trace and job.get("trace") is not None:
+                record["trace"] = job["trace"].summary()
+            print(json.dumps(record), file=out, flush=True)
+    scheduler.shutdown()
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert X/Twitter videos to WebP format')
+    parser.add_argument('url', nargs='?', help='X/Twitter post URL')
+    parser.add_argument('start_time', nargs='?', help='Start time in MM:SS format (00:00 for no trim)')
+    parser.add_argument('end_time', nargs='?', help='End time in MM:SS format (00:00 for no trim)')
+    parser.add_argument('output', nargs='?', help='Output file path ("-" writes it to stdout); "--format auto" may change its extension')
+    parser.add_argument('--serve', action='store_true', help='Run as an HTTP server exposing POST /convert')
+    parser.add_argument('--host', default='127.0.0.1', help='Server bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5000, help='Server port (default: 5000)')
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent encodes in server and batch mode (default: 2)')
+    parser.add_argument('--io-workers', type=int, default=4, help='Concurrent metadata lookups and downloads in server and batch mode (default: 4)')
+    parser.add_argument('--max-jobs', type=int, default=16, help='Jobs admitted at once in server mode; more get 503 (default: 16)')
+    parser.add_argument('--deadline', type=float, default=300.0, help='Seconds before a server or batch job is cancelled (default: 300)')
+    parser.add_argument('--batch', metavar='FILE', help='Convert the jobs listed in FILE ("-" for stdin), one per line')
+    parser.add_argument('--all-videos', action='store_true', help='Convert every video of the post at url')
+    parser.add_argument('--out-dir', default='.', help='Output directory in batch mode (default: .)')
+    parser.add_argument('--decimate', action='store_true',
+                        help='Drop near-duplicate frames and keep variable frame durations (screen recordings, slideshows)')
+    parser.add_argument('--format', default='webp', choices=OUTPUT_FORMATS,
+                        help='Output format; gif uses the preset\'s palette settings, mp4 is the fastest to encode, '
+                             'auto picks the fastest format that fits --max-bytes (default: webp)')
+    parser.add_argument('--per-scene', action='store_true',
+                        help='GIF: build a separate palette for every scene (or gallery image)')
+    parser.add_argument('--slideshow-fps', type=int, default=None,
+                        help=f'Frame rate of gallery slideshows, independent of the preset (default: at most {SLIDESHOW_FPS})')
+    parser.add_argument('--rendition', action='append', metavar='NAME:SIZE[:FPS[:FORMAT]]',
+                        help='Write this rendition to <output>_NAME.<ext> instead of one output; repeat it and '
+                             'every rendition comes from one download and decode (e.g. --rendition emoji:128:15 --rendition chat:400)')
+    parser.add_argument('--trace', action='store_true',
+                        help='Print per-stage timings and resource usage as a final JSON line ({"trace": ...})')
+    parser.add_argument('--preset', default='high', choices=PRESET_NAMES,
+                        help='Quality preset; "auto" tunes fps, size, quality and denoise to the video (default: high)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result and source caches')
+    parser.add_argument('--full-download', action='store_true', help='Always download the whole video instead of only the trim window')
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help=f'Fit the output into this many bytes (Discord: {DISCORD_UPLOAD_LIMIT})')
+    parser.add_argument('--encode-workers', type=int, default=None,
+                        help='Parallel WebP encode chunks per video (default: CPU count, 1 disables)')
+
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(
+            args.host, args.port, args.workers,
+            use_cache=not args.no_cache,
+            target_bytes=args.max_bytes,
+            io_workers=args.io_workers,
+            max_jobs=args.max_jobs,
+            deadline=args.deadline or None,
+        )
+        return
+    if args.slideshow_fps is not None and not 1 <= args.slideshow_fps <= 60:
+        parser.error("--slideshow-fps must be between 1 and 60")
+    if args.rendition and (args.batch or args.all_videos):
+        parser.error("--rendition works on a single url")
+    if args.batch or args.all_videos:
+        jobs = read_batch_file(args.batch) if args.batch else []
+        if args.all_videos:
+            if not args.url:
+                parser.error("--all-videos needs a url")
+            jobs.append({"url": args.url, "start_time": args.start_time, "end_time": args.end_time, "all_videos": True})
+        for job in jobs:
+            job.setdefault("preset", args.preset)
+        sys.exit(run_batch(jobs, args))
+    if not (args.url and args.start_time and args.end_time and args.output):
+        parser.error("url, start_time, end_time and output are required unless --serve or --batch is given")
+
+    to_stdout = args.output == "-"
+    renditions = None
+    if args.rendition:
+        if to_stdout:
+            parser.error("--rendition needs an output path")
+        try:
+            renditions = [Rendition.parse(spec) for spec in args.rendition]
+        except ValueError as e:
+            parser.error(str(e))
+        base = os.path.splitext(args.output)[0]
+        for r in renditions:
+            r.output = f"{base}_{r.name}{ENCODERS.get(r.output_format, WebPEncoder).ext}"
+    trace = Trace()
+    try:
+        # With "-" the WebP owns stdout, so progress messages go to stderr
+        with redirect_stdout(sys.stderr) if to_stdout else nullcontext():
+            result = convert_post(
+                args.url, args.start_time, args.end_time, args.output,
+                result_cache=None if args.no_cache else _RESULT_CACHE,
+                source_cache=None if args.no_cache else _SOURCE_CACHE,
+                ranged=not args.full_download,
+                target_bytes=args.max_bytes,
+                encode_workers=args.encode_workers,
+                preset=args.preset,
+                trace=trace,
+                decimate=args.decimate,
+                output_format=args.format,
+                per_scene=args.per_scene,
+                renditions=renditions,
+                slideshow_fps=args.slideshow_fps,
+            )
     except Exception as e:
-        print(f"Error: {e}")
+        print(_describe_error(e), file=sys.stderr if to_stdout else sys.stdout)
+        if args.trace:
+            print(json.dumps({"trace": trace.summary()}), file=sys.stderr if to_stdout else sys.stdout)
         sys.exit(1)
+    if renditions:
+        print(json.dumps({"renditions": [r.metadata() for r in result]}))
+    if args.trace:
+        print(json.dumps({"trace": trace.summary()}), file=sys.stderr if to_stdout else sys.stdout)
+    if to_stdout:
+        sys.stdout.buffer.write(result)
+        sys.stdout.buffer.flush()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the gif.py conversion pipeline on synthetic local media.
+
+Test clips and images are generated once with ffmpeg's testsrc2/mandelbrot
+sources (no network), then convert_video_to_webp, build_slideshow_webp and
+build_slideshow_video run across the build_preset matrix, and every other
+output encoder (GIF, MP4, AVIF) encodes the clips at each preset. Each case
+reports wall time, child-process CPU time, output bytes and frames, and
+SSIM/PSNR against the exact frames the encoder was given, rendered to raw RGB
+by the same filters (WebP outputs need Pillow to decode; null without it).
+
+    python gif_bench.py                              # run and print a table
+    python gif_bench.py --save-baseline bench_baseline.json   # store results
+    python gif_bench.py --baseline bench_baseline.json        # exit 1 on regressions
+
+bench_baseline.json next to this file is the reference baseline; refresh it
+with --save-baseline when a change is meant to move the numbers. Timings are
+machine-specific, so compare against a baseline saved on the same machine
+before trusting the time columns.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from typing import Optional, List
+
+import gif
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # quality scores need Pillow to decode animated WebP
+    Image = None
+
+PRESETS = ("fast", "medium", "high")
+FORMATS = tuple(name for name in gif.ENCODERS if name != "webp")
+
+# name -> lavfi source; clips are 4 s at 30 fps
+CLIP_SOURCES = {
+    "testsrc": "testsrc2=size=1280x720:rate=30",
+    "mandelbrot": "mandelbrot=size=960x540:rate=30",
+}
+CLIP_SECONDS = 4
+
+# name -> (lavfi source, size): mixed orientations and resolutions
+IMAGE_SOURCES = {
+    "01_testsrc": ("testsrc2", "1600x1200"),
+    "02_mandelbrot": ("mandelbrot", "1200x1600"),
+    "03_bars": ("smptehdbars", "2048x1152"),
+    "04_square": ("testsrc", "1080x1080"),
+}
+
+# Regressions: slower or bigger by more than these fractions, or worse quality
+TIME_TOLERANCE = 0.25
+SIZE_TOLERANCE = 0.05
+SSIM_TOLERANCE = 0.005
+
+def generate_media(media_dir: str):
+    """Render the test clips and images into media_dir unless they exist. Returns (clips, images)."""
+    gif._require_cmd("ffmpeg")
+    os.makedirs(media_dir, exist_ok=True)
+    clips = {}
+    for name, source in CLIP_SOURCES.items():
+        path = os.path.join(media_dir, f"{name}.mp4")
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            gif._run([
+                "ffmpeg", "-y", "-f", "lavfi", "-i", source,
+                "-t", str(CLIP_SECONDS),
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p",
+                "-threads", "1", "-fflags", "+bitexact", "-flags:v", "+bitexact",
+                path,
+            ], check=True)
+        clips[name] = path
+    images = []
+    for name, (source, size) in IMAGE_SOURCES.items():
+        path = os.path.join(media_dir, f"{name}.png")
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            gif._run([
+                "ffmpeg", "-y", "-f", "lavfi", "-i", f"{source}=size={size}",
+                "-frames:v", "1", path,
+            ], check=True)
+        images.append(path)
+    return clips, images
+
+# YUV to RGB conversion for every frame the bench decodes: bilinear chroma
+# upsampling matches what libwebp applies when Pillow decodes a WebP, so the
+# reference and the outputs differ by the encoder, not by the colour path
+TO_RGB = "scale=flags=bilinear+full_chroma_int+accurate_rnd,format=rgb24"
+
+def _reference_frames(inputs: List[str], graph: str, raw: str):
+    """
+    Write the frames filtergraph graph labels [out] to raw as RGB: the exact
+    frames the encoder under test is given, with no lossy step. Returns
+    (width, height, fps).
+    """
+    cmd = ["ffmpeg", "-y"]
+    for path in inputs:
+        cmd.extend(["-i", path])
+    cmd.extend(["-filter_complex", f"{graph};[out]{TO_RGB}[rgb]", "-map", "[rgb]", "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", raw])
+    stderr = gif._run(cmd, check=True).stderr.decode(errors="ignore")
+    stream = re.search(r"Output #0, rawvideo.*?Stream #\d+:\d+: Video: [^\n]*?, (\d+)x(\d+)[^\n]*?, ([\d.]+) fps", stderr, re.S)
+    return int(stream.group(1)), int(stream.group(2)), float(stream.group(3))
+
+def _output_frames(path: str, raw: str, fps: float):
+    """
+    Decode an output file to raw RGB frames at the reference frame rate fps.
+    Returns (width, height), or None for WebP without Pillow.
+    """
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        # ffmpeg cannot decode animated WebP
+        if Image is None:
+            return None
+        with Image.open(path) as im, open(raw, "wb") as f:
+            # libwebp merges identical consecutive frames into one longer
+            # frame, so repeat each for every reference frame whose midpoint
+            # it covers (durations are rounded to milliseconds)
+            tick = end = 0
+            for frame in ImageSequence.Iterator(im):
+                data = frame.convert("RGB").tobytes()
+                end += frame.info.get("duration", 0)
+                while (tick + 0.5) * 1000 / fps < end:
+                    f.write(data)
+                    tick += 1
+            return im.width, im.height
+    info = gif.probe_media(path)
+    gif._run(["ffmpeg", "-y", "-i", path, "-vf", TO_RGB, "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", raw], check=True)
+    return info.width, info.height
+
+def quality(output: str, reference: str, reference_format: tuple, work_dir: str):
+    """
+    SSIM and PSNR (dB) of an output file of any format against raw reference
+    frames and their (width, height, fps) from _reference_frames, or
+    (None, None) for WebP without Pillow.
+    """
+    width, height, fps = reference_format
+    raw = os.path.join(work_dir, "out.rgb")
+    size = _output_frames(output, raw, fps)
+    if size is None:
+        return None, None
+    if size != (width, height):
+        raise ValueError(f"Frame size differs from reference: {size[0]}x{size[1]} vs {width}x{height}")
+    # Frames are paired by index, up to the shorter of the two
+    count = min(os.path.getsize(raw), os.path.getsize(reference)) // (width * height * 3)
+
+    def compare(metric: str) -> str:
+        raw_input = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}"]
+        result = gif._run(
+            ["ffmpeg", "-hide_banner", *raw_input, "-i", raw, *raw_input, "-i", reference,
+             "-lavfi", f"[0:v][1:v]{metric}", "-frames:v", str(count), "-f", "null", "-"],
+            check=True,
+        )
+        return result.stderr.decode(errors="ignore")
+
+    ssim = re.search(r"All:([\d.]+)", compare("ssim"))
+    psnr = re.search(r"average:([\d.]+|inf)", compare("psnr"))
+    return (
+        round(float(ssim.group(1)), 5) if ssim else None,
+        round(float(psnr.group(1)), 3) if psnr and psnr.group(1) != "inf" else None,
+    )
+
+def _measure(fn, repeat: int):
+    """Run fn repeat times; returns (its result, best wall time, child CPU of that run)."""
+    best = None
+    for _ in range(repeat):
+        trace = gif.Trace()
+        token = gif._CURRENT_TRACE.set(trace)
+        started = time.monotonic()
+        try:
+            result = fn()
+        finally:
+            gif._CURRENT_TRACE.reset(token)
+        seconds = time.monotonic() - started
+        cpu = sum(s.get("cpu_seconds", 0.0) for s in trace.summary()["spans"])
+        if best is None or seconds < best[1]:
+            best = (result, seconds, cpu)
+    return best
+
+def run_cases(
+    clips: dict,
+    images: List[str],
+    work_dir: str,
+    repeat: int = 1,
+    only: Optional[str] = None,
+    out=None,
+) -> List[dict]:
+    """Run every case (or those matching the `only` regex), printing a table row to out as each finishes."""
+    out = out or sys.stdout
+    results = []
+
+    def record(case: str, output: str, seconds: float, cpu: float, ssim=None, psnr=None):
+        with open(output, "rb") as f:
+            data = f.read()
+        entry = {
+            "case": case,
+            "seconds": round(seconds, 3),
+            "cpu_seconds": round(cpu, 3),
+            "bytes": len(data),
+            "frames": (
+                gif.webp_frame_count(data) if data[:4] == b"RIFF"
+                else gif.gif_frame_count(data) if data[:3] == b"GIF" else None
+            ),
+            "ssim": ssim,
+            "psnr": psnr,
+        }
+        results.append(entry)
+        print(_format_row(entry), file=out, flush=True)
+
+    references = {}
+
+    def reference(key: tuple, inputs: List[str], graph: str):
+        """Raw reference frames for key, rendered once: (path, (width, height, fps))."""
+        if key not in references:
+            raw = os.path.join(work_dir, f"ref_{len(references)}.rgb")
+            references[key] = (raw, _reference_frames(inputs, graph, raw))
+        return references[key]
+
+    def video_reference(clip_name: str, preset: dict, even: bool = False):
+        clip = clips[clip_name]
+        chain = ",".join(gif._video_filters(
+            gif.probe_media(clip), preset['max_size'], preset['fps'], None, preset['quality_boost'], even=even))
+        return reference((clip_name, preset['max_size'], preset['fps'], preset['quality_boost'], even), [clip], f"[0:v]{chain}[out]")
+
+    print(_format_row(None), file=out, flush=True)
+    for preset_name in PRESETS:
+        preset = gif.build_preset(preset_name)
+        for clip_name, clip in clips.items():
+            case = f"video/{clip_name}/{preset_name}"
+            if not only or re.search(only, case):
+                output = os.path.join(work_dir, f"{clip_name}_{preset_name}.webp")
+                args = dict(
+                    max_size=preset['max_size'],
+                    fps=preset['fps'],
+                    webp_quality=preset['webp_quality'],
+                    quality_boost=preset['quality_boost'],
+                )
+                _, seconds, cpu = _measure(lambda: gif.convert_video_to_webp(clip, output, **args), repeat)
+                ssim, psnr = quality(output, *video_reference(clip_name, preset), work_dir)
+                record(case, output, seconds, cpu, ssim, psnr)
+
+            for name in FORMATS:
+                case = f"{name}/{clip_name}/{preset_name}"
+                if only and not re.search(only, case):
+                    continue
+                encoder = gif.get_encoder(name)
+                output = os.path.join(work_dir, f"{clip_name}_{preset_name}{encoder.ext}")
+                _, seconds, cpu = _measure(lambda: encoder.encode_video(clip, output, preset), repeat)
+                # The 4:2:0 video codecs round the frame size down to even
+                even = isinstance(encoder, gif.VideoCodecEncoder)
+                ssim, psnr = quality(output, *video_reference(clip_name, preset, even), work_dir)
+                record(case, output, seconds, cpu, ssim, psnr)
+
+        case = f"slideshow_webp/{preset_name}"
+        if not only or re.search(only, case):
+            output = os.path.join(work_dir, f"slideshow_{preset_name}.webp")
+            _, seconds, cpu = _measure(lambda: gif.build_slideshow_webp(
+                images, output,
+                max_size=preset['max_size'],
+                fps=gif.SLIDESHOW_FPS,
+                webp_quality=preset['webp_quality'],
+                seconds_per_image=1.0,
+                quality_boost=preset['quality_boost'],
+            ), repeat)
+            graph = gif._slideshow_graph(
+                len(images), preset['max_size'], gif.SLIDESHOW_FPS, 1.0, None, None, preset['quality_boost'])
+            ssim, psnr = quality(output, *reference(("slideshow", preset_name), images, graph), work_dir)
+            record(case, output, seconds, cpu, ssim, psnr)
+
+        case = f"slideshow_video/{preset_name}"
+        if not only or re.search(only, case):
+            output = os.path.join(work_dir, f"slideshow_{preset_name}.mp4")
+            _, seconds, cpu = _measure(lambda: gif.build_slideshow_video(
+                images, output, fps=preset['fps'], seconds_per_image=1.0), repeat)
+            clip_filter = gif._slideshow_clip_filter(preset['fps'], 1.0)
+            graph = ";".join(f"[{i}:v]{clip_filter}[v{i}]" for i in range(len(images)))
+            graph += ";" + "".join(f"[v{i}]" for i in range(len(images))) + f"concat=n={len(images)}:v=1:a=0[out]"
+            ssim, psnr = quality(output, *reference(("slideshow_video", preset['fps']), images, graph), work_dir)
+            record(case, output, seconds, cpu, ssim, psnr)
+    return results
+
+def _format_row(entry: Optional[dict]) -> str:
+    if entry is None:
+        return f"{'case':<28} {'wall s':>8} {'cpu s':>8} {'bytes':>10} {'frames':>6} {'ssim':>8} {'psnr':>7}"
+
+    def cell(value, fmt: str) -> str:
+        return format(value, fmt) if value is not None else "-"
+
+    return (
+        f"{entry['case']:<28} {entry['seconds']:>8.2f} {entry['cpu_seconds']:>8.2f} {entry['bytes']:>10} "
+        f"{cell(entry['frames'], 'd'):>6} {cell(entry['ssim'], '.4f'):>8} {cell(entry['psnr'], '.2f'):>7}"
+    )
+
+def find_regressions(results: List[dict], baseline: List[dict]) -> List[str]:
+    """Compare against baseline results; returns one message per regression."""
+    previous = {entry["case"]: entry for entry in baseline}
+    problems = []
+    for entry in results:
+        base = previous.get(entry["case"])
+        if base is None:
+            continue
+        case = entry["case"]
+        # CPU time is steadier than wall time on a busy machine; fall back to wall
+        key = "cpu_seconds" if base.get("cpu_seconds") else "seconds"
+        if base[key] and entry[key] > base[key] * (1 + TIME_TOLERANCE):
+            problems.append(f"{case}: {key} {base[key]:.2f} -> {entry[key]:.2f}")
+        if entry["bytes"] > base["bytes"] * (1 + SIZE_TOLERANCE):
+            problems.append(f"{case}: bytes {base['bytes']} -> {entry['bytes']}")
+        if entry["ssim"] is not None and base.get("ssim") is not None and entry["ssim"] < base["ssim"] - SSIM_TOLERANCE:
+            problems.append(f"{case}: ssim {base['ssim']:.4f} -> {entry['ssim']:.4f}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gif.py conversions on synthetic local media')
+    parser.add_argument('--media-dir', default=os.path.join(gif.CACHE_DIR, "bench"),
+                        help='Where generated test media is kept (default: <cache dir>/bench)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest is reported (default: 1)')
+    parser.add_argument('--only', help='Only run cases matching this regex (e.g. "video/.*/fast")')
+    parser.add_argument('--compression-level', type=int, default=None,
+                        help=f'Override the libwebp compression level (default: {gif.WEBP_COMPRESSION_LEVEL})')
+    parser.add_argument('--baseline', help='Compare against this results file and exit 1 on regressions')
+    parser.add_argument('--save-baseline', help='Write the results to this file')
+    args = parser.parse_args()
+
+    if args.compression_level is not None:
+        gif.WEBP_COMPRESSION_LEVEL = args.compression_level
+    if Image is None:
+        print("Pillow is not installed: SSIM/PSNR are skipped")
+
+    clips, images = generate_media(args.media_dir)
+    out = sys.stdout
+    with tempfile.TemporaryDirectory(prefix="gif_bench_") as work_dir:
+        # The pipeline's progress messages go to stderr; the table to stdout
+        with redirect_stdout(sys.stderr):
+            results = run_cases(clips, images, work_dir, repeat=max(1, args.repeat), only=args.only, out=out)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = find_regressions(results, json.load(f))
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import shutil
+import subprocess
+from fractions import Fraction
+
+import pytest
+import yt_dlp
+
+import gif
+
+
+def _gif(palette: bytes, frames: int = 1) -> bytes:
+    """A 1x1 GIF with a two-color global palette and `frames` frames of color 0."""
+    screen = (1).to_bytes(2, "little") * 2 + bytes([0x80, 0, 0])
+    frame = (
+        bytes([0x21, 0xF9, 4, 0, 10, 0, 0, 0])
+        + bytes([0x2C]) + bytes(4) + (1).to_bytes(2, "little") * 2 + bytes([0])
+        + bytes([2, 2, 0x44, 0x01, 0])
+    )
+    return b"GIF89a" + screen + palette + frame * frames + b"\x3b"
+
+
+RED_BLACK = bytes([255, 0, 0, 0, 0, 0])
+GREEN_BLACK = bytes([0, 255, 0, 0, 0, 0])
+
+
+def test_join_animated_gif_keeps_every_frame():
+    joined = gif.join_animated_gif([_gif(RED_BLACK, 2), _gif(RED_BLACK, 3)])
+    assert gif.gif_frame_count(joined) == 5
+    screen, gct, blocks = gif._parse_gif(joined)
+    assert gct == RED_BLACK
+    assert all(not block[9] & 0x80 for kind, block in blocks if kind == 0x2C)
+
+
+def test_join_animated_gif_moves_a_differing_palette_to_the_frame():
+    joined = gif.join_animated_gif([_gif(RED_BLACK), _gif(GREEN_BLACK)])
+    images = [block for kind, block in gif._parse_gif(joined)[2] if kind == 0x2C]
+    assert len(images) == 2
+    assert not images[0][9] & 0x80
+    assert images[1][9] & 0x80 and images[1][10:16] == GREEN_BLACK
+
+
+def test_fix_piped_webp_moves_the_size_into_the_header():
+    body = b"WEBP" + b"VP8L" + (2).to_bytes(4, "little") + b"\0\0"
+    piped = b"RIFF" + bytes(4) + body + len(body).to_bytes(4, "little")
+    fixed = gif._fix_piped_webp(piped)
+    assert fixed == b"RIFF" + len(body).to_bytes(4, "little") + body
+    assert gif._fix_piped_webp(fixed) == fixed
+
+
+def test_chunk_plan_covers_the_clip():
+    info = gif.MediaInfo(fps=Fraction(30), duration=12.0)
+    plan = gif._chunk_plan(20, None, None, info, workers=4, min_chunk_seconds=1.0)
+    assert len(plan) == 4
+    assert sum(frames for _, _, frames in plan) == 240
+    assert plan[0][0] == "0.000000"
+    assert plan[-1][1] == "12.000000"
+    for (_, end, _), (start, _, _) in zip(plan, plan[1:]):
+        assert float(end) > float(start)
+
+
+def test_chunk_plan_clamps_end_past_eof():
+    info = gif.MediaInfo(fps=Fraction(30), duration=12.0)
+    assert gif._chunk_plan(20, "00:00", "00:30", info, 4, 1.0) == gif._chunk_plan(20, None, None, info, 4, 1.0)
+
+
+def test_chunk_plan_short_clip_is_not_split():
+    info = gif.MediaInfo(fps=Fraction(30), duration=1.5)
+    assert gif._chunk_plan(20, None, None, info, workers=4, min_chunk_seconds=1.0) is None
+
+
+def test_scene_plan_without_duration():
+    info = gif.MediaInfo(fps=Fraction(30))
+    plan = gif._scene_plan([1.0], 20, None, None, info)
+    assert plan == [("0.000000", "1.050000", 20), ("1.000000", None, None)]
+
+
+def test_scene_plan_clamps_end_past_eof():
+    info = gif.MediaInfo(fps=Fraction(30), duration=4.0)
+    plan = gif._scene_plan([1.0], 20, None, "00:30", info)
+    assert plan == [("0.000000", "1.050000", 20), ("1.000000", "4.000000", 60)]
+
+
+IMAGE = "https://pbs.twimg.com/media/ABC.jpg?format=jpg&name=small"
+
+
+def test_image_size_map_picks_the_smallest_covering_variant():
+    sizes = gif.ImageSizeMap()
+    assert sizes.variant("1", IMAGE, 400) == "small"  # unknown: assume square
+    sizes.record("1", IMAGE, 680, 340, bound=680)
+    assert sizes.get("1", IMAGE) == (680, 340, False)
+    assert sizes.variant("1", IMAGE, 400) == "medium"  # 1200 x 600
+    sizes.record("1", IMAGE, 1000, 500)  # the original: medium is already full size
+    assert sizes.get("1", IMAGE) == (1000, 500, True)
+    assert sizes.variant("1", IMAGE, 300) == "small"
+    assert sizes.variant("1", IMAGE, 600) == "medium"
+
+
+def test_image_size_map_drops_the_least_recently_used_post():
+    sizes = gif.ImageSizeMap(max_posts=2)
+    for post_id in ("1", "2"):
+        sizes.record(post_id, IMAGE, 100, 100)
+    sizes.get("1", IMAGE)
+    sizes.record("3", IMAGE, 100, 100)
+    assert sizes.get("2", IMAGE) is None
+    assert sizes.get("1", IMAGE) and sizes.get("3", IMAGE)
+
+
+def test_rendition_parse():
+    r = gif.Rendition.parse("emoji:128:15")
+    assert (r.name, r.max_size, r.fps, r.output_format) == ("emoji", 128, 15, "webp")
+    r = gif.Rendition.parse("preview:720::mp4")
+    assert (r.max_size, r.fps, r.output_format) == (720, None, "mp4")
+    for spec in ("emoji", ":128", "a:1:2:webp:x", "a:1::bmp"):
+        with pytest.raises(ValueError):
+            gif.Rendition.parse(spec)
+
+
+def _fake_post(monkeypatch, clip: str):
+    info = {
+        "id": "123", "ext": "mp4", "duration": 2, "width": 160, "height": 120, "fps": 10,
+        "url": "file://" + clip, "format_id": "http-1", "protocol": "https",
+        "formats": [{
+            "format_id": "http-1", "url": "file://" + clip, "ext": "mp4", "protocol": "https",
+            "width": 160, "height": 120, "fps": 10, "vcodec": "avc1", "acodec": "none",
+        }],
+    }
+
+    def process_ie_result(self, ie_result, download=True, extra_info=None):
+        if download:
+            shutil.copy(clip, self.prepare_filename(ie_result))
+        return ie_result
+
+    monkeypatch.setattr(yt_dlp.YoutubeDL, "extract_info", lambda self, url, download=True, **kw: dict(info))
+    monkeypatch.setattr(yt_dlp.YoutubeDL, "process_ie_result", process_ie_result)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None, reason="needs ffmpeg")
+def test_convert_post_extracts_the_post_once(tmp_path, monkeypatch):
+    clip = str(tmp_path / "clip.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x120:rate=10", "-t", "2", "-pix_fmt", "yuv420p", clip],
+        check=True, capture_output=True,
+    )
+    _fake_post(monkeypatch, clip)
+    before = gif.PostInfo.extract_count
+    out = gif.convert_post(
+        "https://x.com/u/status/123", "00:00", "00:01", str(tmp_path / "out.webp"),
+        work_dir=str(tmp_path), result_cache=None, source_cache=None, ranged=False, preset="fast",
+    )
+    assert gif.PostInfo.extract_count - before == 1
+    with open(out, "rb") as f:
+        assert gif.webp_frame_count(f.read()) > 0
+
+
+def test_post_info_cache_fetches_each_post_once(monkeypatch):
+    monkeypatch.setattr(yt_dlp.YoutubeDL, "extract_info", lambda self, url, download=True, **kw: {"id": "123"})
+    posts = gif.PostInfoCache()
+    before = gif.PostInfo.extract_count
+    first = posts.get("https://x.com/u/status/123/video/1")
+    assert posts.get("https://x.com/u/status/123/video/2") is first
+    assert gif.PostInfo.extract_count - before == 1